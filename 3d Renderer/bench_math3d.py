@@ -0,0 +1,58 @@
+# bench_math3d.py -- micro-benchmark for Point/Vector arithmetic
+#    usage: python bench_math3d.py
+# Reports the memory used per Point/Vector, the time for the vector
+# operations done on every ray, and the time to trace a small scene.
+
+import time
+import tracemalloc
+from timeit import timeit
+
+from ren3d.math3d import Point, Vector
+from ren3d.ray3d import Ray, Interval
+from ren3d.models import Sphere, Record
+
+
+def memory_per_object(make, n=10000):
+    tracemalloc.start()
+    objs = [make(i) for i in range(n)]
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / n
+
+
+def main():
+    print("bytes per Point: {:0.0f}".format(
+        memory_per_object(lambda i: Point((i, 2., 3.)))))
+    print("bytes per Vector: {:0.0f}".format(
+        memory_per_object(lambda i: Vector((i, 2., 3.)))))
+
+    p = Point((1, 2, 3))
+    v = Vector((.3, -.2, .9))
+    w = Vector((1, 1, 0))
+    n = 100000
+    tests = [("p + v", lambda: p + v),
+             ("p - p", lambda: p - p),
+             ("v * 2.5", lambda: v * 2.5),
+             ("v.dot(w)", lambda: v.dot(w)),
+             ("v.cross(w)", lambda: v.cross(w)),
+             ("v.normalized()", lambda: v.normalized()),
+             ("ray.point_at(t)", lambda: ray.point_at(2.5)),
+             ("sphere.intersect", lambda: sphere.intersect(
+                 ray, Interval(), Record()))]
+    ray = Ray(Point((0, 0, 0)), Vector((0, 0, -1)))
+    sphere = Sphere((0, 0, -10), 2)
+    for name, fn in tests:
+        t = timeit(fn, number=n)
+        print("{:18s} {:6.3f} us".format(name, t/n*1e6))
+
+    from ren3d.scenedef import load_scene
+    from ren3d.render_ray import raytrace
+    from ren3d.image import Image
+    scene, name = load_scene("scene9")
+    t1 = time.time()
+    raytrace(scene, Image((80, 60)))
+    print("scene9 80x60: {:0.2f} s".format(time.time()-t1))
+
+
+if __name__ == "__main__":
+    main()
@@ -57,8 +57,9 @@ def assemble_chunks(chunks, size):
     for chunk_num, chunk in enumerate(chunks):
         y = chunk_num
         for line in chunk:
-            for x in range(size[0]):
-                img[(x, y)] = line[x]
+            # remote chunks can't share memory; copy in whole lines
+            img.set_tile((0, y, size[0], y+1),
+                         bytes(v for rgb in line for v in rgb))
             y += nchunks
     return img
 
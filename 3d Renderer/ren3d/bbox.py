@@ -68,9 +68,23 @@ class BoundingBox:
         low, high = self.bounds
         return Point((low + high)*.5)
 
+    @property
+    def area(self):
+        """ return the surface area of the box
+
+        >>> BoundingBox((0, 0, 0), (1, 2, 3)).area
+        22.0
+        >>> BoundingBox().area
+        0.0
+        """
+        dx, dy, dz = self.bounds[1] - self.bounds[0]
+        if dx < 0 or dy < 0 or dz < 0:
+            return 0.0
+        return 2*(dx*dy + dy*dz + dz*dx)
+
     def include_box(self, bbox):
         """expand to encompass bbox"""
-        self.include_points(bbox.corners)
+        self.include_points(bbox.bounds)
 
     def combine(self, other):
         """returns a new bbox the encloses self and other"""
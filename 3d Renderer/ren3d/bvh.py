@@ -1,31 +1,195 @@
 #bvh.py
+#   Bounding volume hierarchy for fast ray intersection with many surfaces
 
-def make_BVH(surfaces):
-    #build BVH from list of Surfaces
+from array import array
+from math import inf
+
+from ren3d.bbox import BoundingBox
+from ren3d.models import Record
+
+# relative costs used by the surface area heuristic
+TRAVERSAL_COST = 1.0
+INTERSECT_COST = 1.0
+
+
+def make_BVH(surfaces, axis=0):
+    #build BVH from list of Surfaces, splitting at the median
     assert len(surfaces) > 0
     if len(surfaces) == 1:
         return surfaces[0]
+
+    #sort the objects by "midpoint" along axis
+    def keyfn(s): return s.bbox.midpoint[axis]
+    surfaces.sort(key=keyfn)
+
+    #split into 2 halves
+    n = len(surfaces) // 2
+    next_axis = (axis + 1) % 3
+    return BVH(make_BVH(surfaces[:n], next_axis),
+               make_BVH(surfaces[n:], next_axis))
+
+
+def make_SAH_BVH(surfaces, nbins=12, maxleaf=4):
+    """build BVH from list of Surfaces using a binned surface area
+    heuristic. At each node the centroids are dropped into nbins bins
+    along every axis and the cheapest split is taken. Nodes with at most
+    maxleaf surfaces become leaves when that is cheaper than splitting.
+    """
+    assert len(surfaces) > 0
+    items = []
+    for s in surfaces:
+        low, high = s.bbox.bounds
+        box = tuple(low) + tuple(high)
+        centroid = tuple((box[a] + box[a+3])/2 for a in range(3))
+        items.append((box, centroid, s))
+    return _build_sah(items, nbins, maxleaf)
+
+
+def _union(b1, b2):
+    # union of two boxes stored as (lx, ly, lz, hx, hy, hz)
+    return (min(b1[0], b2[0]), min(b1[1], b2[1]), min(b1[2], b2[2]),
+            max(b1[3], b2[3]), max(b1[4], b2[4]), max(b1[5], b2[5]))
+
+
+def _enclose(boxes):
+    # box enclosing a (non-empty) list of boxes
+    cols = list(zip(*boxes))
+    return tuple(map(min, cols[:3])) + tuple(map(max, cols[3:]))
+
+
+def _area(b):
+    dx, dy, dz = b[3]-b[0], b[4]-b[1], b[5]-b[2]
+    if dx < 0 or dy < 0 or dz < 0:
+        return 0.0
+    return 2*(dx*dy + dy*dz + dz*dx)
+
+
+_EMPTY = (float("inf"),)*3 + (-float("inf"),)*3
+
+
+def _build_sah(items, nbins, maxleaf, wrap=False):
+    # items are (box, centroid, payload) triples. Single payloads become
+    # leaves themselves unless wrap is set.
+    n = len(items)
+    if n == 1:
+        box, c, s = items[0]
+        return BVHLeaf([s], box) if wrap else s
+
+    box = _enclose([b for b, c, s in items])
+    cbox = _enclose([c + c for b, c, s in items])
+    area = _area(box)
+
+    best_cost, best_axis, best_bin = float("inf"), None, None
+    for axis in range(3):
+        cmin, cmax = cbox[axis], cbox[axis+3]
+        if cmax <= cmin:
+            continue
+        scale = nbins / (cmax - cmin)
+        last = nbins - 1
+        members = [[] for i in range(nbins)]
+        for b, c, s in items:
+            i = int((c[axis]-cmin)*scale)
+            members[i if i < last else last].append(b)
+        counts = [len(m) for m in members]
+        boxes = [_enclose(m) if m else _EMPTY for m in members]
+
+        # sweep from the right to get the cost of each right side
+        right_costs = [0.0]*nbins
+        rbox, rcount = _EMPTY, 0
+        for i in range(last, 0, -1):
+            if counts[i]:
+                rbox = _union(rbox, boxes[i])
+                rcount += counts[i]
+            right_costs[i] = _area(rbox) * rcount
+
+        lbox, lcount = _EMPTY, 0
+        for i in range(last):
+            if not counts[i]:
+                continue
+            lbox = _union(lbox, boxes[i])
+            lcount += counts[i]
+            if lcount == n:
+                break
+            cost = _area(lbox) * lcount + right_costs[i+1]
+            if cost < best_cost:
+                best_cost, best_axis, best_bin = cost, axis, i
+
+    leaf_cost = area * n * INTERSECT_COST
+    if best_axis is None:
+        # all centroids coincide, no useful split
+        if n <= maxleaf:
+            return BVHLeaf([s for b, c, s in items], box)
+        half = n // 2
+        left, right = items[:half], items[half:]
     else:
-        return BVH(surfaces)
+        split_cost = area*TRAVERSAL_COST + best_cost*INTERSECT_COST
+        if n <= maxleaf and leaf_cost <= split_cost:
+            return BVHLeaf([s for b, c, s in items], box)
+        cmin, cmax = cbox[best_axis], cbox[best_axis+3]
+        scale = nbins / (cmax - cmin)
+        left, right = [], []
+        for item in items:
+            i = min(nbins-1, int((item[1][best_axis]-cmin)*scale))
+            (left if i <= best_bin else right).append(item)
+
+    return BVH(_build_sah(left, nbins, maxleaf, wrap),
+               _build_sah(right, nbins, maxleaf, wrap))
+
+
+def _build_median(items, axis=0):
+    # median split of (box, centroid, index) triples into BVHLeafs
+    if len(items) == 1:
+        box, c, s = items[0]
+        return BVHLeaf([s], box)
+    items.sort(key=lambda item: item[1][axis])
+    n = len(items) // 2
+    next_axis = (axis + 1) % 3
+    return BVH(_build_median(items[:n], next_axis),
+               _build_median(items[n:], next_axis))
+
+
+BUILDERS = {"median": make_BVH, "sah": make_SAH_BVH}
 
-class BVH:
 
-    def __init__(self, surfaces, axis=0):
-        n = len(surfaces)
-        assert n > 1
+def build_BVH(surfaces, method="sah"):
+    """build a BVH over surfaces using the named method (see BUILDERS)"""
+    try:
+        builder = BUILDERS[method]
+    except KeyError:
+        raise ValueError("Unknown BVH method: {}".format(method))
+    return builder(list(surfaces))
 
-        #sort the ibjects by "midpoint" along axis
-        def keyfn(s): return s.bbox.midpoint[axis]
-        surfaces.sort(key=keyfn)
 
-        #spli into 2 halves
-        n = n // 2
-        next_axis = (axis + 1) % 3
-        self.left = make_BVH(surfaces[:n], next_axis)
-        self.right = make_BVH(surfaces[n:], next_axis)
+def build_index_BVH(boxes, method="sah"):
+    """build a BVH over primitives known only by their bounding boxes,
+    given as (lx, ly, lz, hx, hy, hz) tuples. The leaves are BVHLeafs
+    holding indexes into boxes. With method None, a single leaf holds
+    every index.
+    """
+    assert len(boxes) > 0
+    items = []
+    for i, b in enumerate(boxes):
+        items.append((b, ((b[0]+b[3])/2, (b[1]+b[4])/2, (b[2]+b[5])/2), i))
+    if not method:
+        return BVHLeaf(list(range(len(boxes))), _enclose(boxes))
+    if method == "sah":
+        return _build_sah(items, 12, 4, wrap=True)
+    if method == "median":
+        return _build_median(items)
+    raise ValueError("Unknown BVH method: {}".format(method))
 
+
+class BVH:
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
         self.bbox = self.left.bbox.combine(self.right.bbox)
 
+    def iter_polygons(self):
+        yield from self.left.iter_polygons()
+        yield from self.right.iter_polygons()
+
     def intersect(self, ray, interval, info):
         if not self.bbox.hit(ray, interval):
             return False
@@ -35,9 +199,272 @@ class BVH:
             hit = True
             interval.high = info.t
 
-        #repeat wiht right
+        #repeat with right
         if self.right.intersect(ray, interval, info):
             hit = True
             interval.high = info.t
-            
+
         return hit
+
+    def occluded(self, ray, interval):
+        return (self.bbox.hit(ray, interval)
+                and (self.left.occluded(ray, interval)
+                     or self.right.occluded(ray, interval)))
+
+
+class BVHLeaf:
+    """A BVH leaf holding a few surfaces that are tested in turn"""
+
+    def __init__(self, surfaces, box):
+        self.surfaces = surfaces
+        self.bbox = BoundingBox(box[:3], box[3:])
+
+    def iter_polygons(self):
+        for s in self.surfaces:
+            yield from s.iter_polygons()
+
+    def intersect(self, ray, interval, info):
+        if not self.bbox.hit(ray, interval):
+            return False
+        hit = False
+        for s in self.surfaces:
+            if s.intersect(ray, interval, info):
+                interval.high = info.t
+                hit = True
+        return hit
+
+    def occluded(self, ray, interval):
+        if not self.bbox.hit(ray, interval):
+            return False
+        for s in self.surfaces:
+            if s.occluded(ray, interval):
+                return True
+        return False
+
+
+class FlatBVH:
+    """A BVH flattened into arrays for fast traversal.
+
+    Nodes are stored depth first, so the first child of node i is node
+    i+1. For each node, bounds holds 6 floats (low then high corner) and
+    nodes holds 3 ints: (second child, 0, split axis) for inner nodes, or
+    (first primitive, primitive count, 0) for leaves, where the primitives
+    of a leaf are a contiguous run of prims.
+    """
+
+    def __init__(self, root):
+        self.bounds = array("d")
+        self.nodes = array("i")
+        self.prims = []
+        self._flatten(root)
+        self._make_bbox()
+
+    def _make_bbox(self):
+        self.bbox = BoundingBox(self.bounds[:3], self.bounds[3:6])
+
+    def refit(self):
+        """recompute the node bounds from the current bounding boxes of
+        the primitives (after some have moved), keeping the tree"""
+        bounds, nodes, prims = self.bounds, self.nodes, self.prims
+        # children follow their parents, so work back from the end
+        for i in reversed(range(len(nodes) // 3)):
+            first, count = nodes[3*i], nodes[3*i+1]
+            if count:
+                box = _enclose([tuple(low) + tuple(high) for low, high in
+                                (s.bbox.bounds
+                                 for s in prims[first:first+count])])
+            else:
+                box = _union(bounds[6*(i+1):6*(i+2)],
+                             bounds[6*first:6*first+6])
+            bounds[6*i:6*i+6] = array("d", box)
+        self._make_bbox()
+
+    def _flatten(self, root):
+        stack = [(root, None)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(self.nodes) // 3
+            if parent is not None:
+                self.nodes[3*parent] = index
+            low, high = node.bbox.bounds
+            self.bounds.extend(low)
+            self.bounds.extend(high)
+            if type(node) == BVH:
+                axis = _split_axis(node)
+                self.nodes.extend((0, 0, axis))
+                # the child lower on axis comes first (_traverse relies
+                # on this); it is pushed last so that it directly
+                # follows node
+                lower, upper = node.left, node.right
+                if lower.bbox.midpoint[axis] > upper.bbox.midpoint[axis]:
+                    lower, upper = upper, lower
+                stack.append((upper, index))
+                stack.append((lower, None))
+            else:
+                surfaces = node.surfaces if type(node) == BVHLeaf else [node]
+                self.nodes.extend((len(self.prims), len(surfaces), 0))
+                self.prims.extend(surfaces)
+
+    def iter_polygons(self):
+        for s in self.prims:
+            yield from s.iter_polygons()
+
+    def intersect(self, ray, interval, info):
+        return self._traverse(ray, interval, info)
+
+    def occluded(self, ray, interval):
+        """ True iff ray hits anything within interval. Traversal stops
+        at the first hit found."""
+        return bool(self._traverse(ray, interval, None))
+
+    def occluder(self, ray, interval):
+        """ the first primitive found that ray hits within interval, or
+        None """
+        return self._traverse(ray, interval, None) or None
+
+    def _traverse(self, ray, interval, info):
+        # closest hit into info (returns True iff found), or if info is
+        # None, the result of occluded_prims for the first leaf hit
+        sx, sy, sz = ray.start
+        dx, dy, dz = ray.dir
+        ix = 1/dx if dx else inf
+        iy = 1/dy if dy else inf
+        iz = 1/dz if dz else inf
+        negative = (dx < 0, dy < 0, dz < 0)
+        bounds, nodes = self.bounds, self.nodes
+        low = interval.low
+        hit = False
+        stack = [0]
+        push, pop = stack.append, stack.pop
+        while stack:
+            i = pop()
+            # slab test against node bounds (nan from 0*inf is ignored)
+            b = 6*i
+            t0, t1 = low, interval.high
+            if ix >= 0:
+                tnear, tfar = (bounds[b]-sx)*ix, (bounds[b+3]-sx)*ix
+            else:
+                tnear, tfar = (bounds[b+3]-sx)*ix, (bounds[b]-sx)*ix
+            if tnear > t0: t0 = tnear
+            if tfar < t1: t1 = tfar
+            if t0 > t1:
+                continue
+            if iy >= 0:
+                tnear, tfar = (bounds[b+1]-sy)*iy, (bounds[b+4]-sy)*iy
+            else:
+                tnear, tfar = (bounds[b+4]-sy)*iy, (bounds[b+1]-sy)*iy
+            if tnear > t0: t0 = tnear
+            if tfar < t1: t1 = tfar
+            if t0 > t1:
+                continue
+            if iz >= 0:
+                tnear, tfar = (bounds[b+2]-sz)*iz, (bounds[b+5]-sz)*iz
+            else:
+                tnear, tfar = (bounds[b+5]-sz)*iz, (bounds[b+2]-sz)*iz
+            if tnear > t0: t0 = tnear
+            if tfar < t1: t1 = tfar
+            if t0 > t1:
+                continue
+
+            n = 3*i
+            count = nodes[n+1]
+            if count:
+                if info is None:
+                    blocker = self.occluded_prims(nodes[n], count, ray,
+                                                  interval)
+                    if blocker:
+                        return blocker
+                elif self.intersect_prims(nodes[n], count, ray, interval,
+                                          info):
+                    hit = True
+            elif negative[nodes[n+2]]:
+                # ray runs toward low end of split axis: upper child first
+                push(i+1)
+                push(nodes[n])
+            else:
+                push(nodes[n])
+                push(i+1)
+        return hit
+
+    def intersect_prims(self, first, count, ray, interval, info):
+        """intersect ray with the count primitives of a leaf starting at
+        prims[first], shrinking interval to the closest hit."""
+        hit = False
+        for s in self.prims[first:first+count]:
+            if s.intersect(ray, interval, info):
+                interval.high = info.t
+                hit = True
+        return hit
+
+    def occluded_prims(self, first, count, ray, interval):
+        """the first of the count primitives of a leaf starting at
+        prims[first] that ray hits, or None"""
+        for s in self.prims[first:first+count]:
+            if s.occluded(ray, interval):
+                return s
+        return None
+
+
+def _split_axis(node):
+    # axis along which the children of node are most separated
+    c1 = node.left.bbox.midpoint
+    c2 = node.right.bbox.midpoint
+    return max(range(3), key=lambda a: abs(c2[a]-c1[a]))
+
+
+def bvh_stats(root):
+    """return a Record of statistics about the tree rooted at root:
+    number of inner nodes and leaves, surfaces, maximum and average leaf
+    depth, average and maximum leaf size, and the expected cost of
+    tracing a ray according to the surface area heuristic.
+    """
+    stats = Record(nodes=0, leaves=0, surfaces=0, max_depth=0,
+                   max_leaf=0, cost=0.0)
+    depth_total = 0
+    root_area = root.bbox.area or 1.0
+    walk = _walk_flat(root) if type(root) == FlatBVH else _walk_tree(root)
+    for area, depth, size in walk:
+        ratio = area / root_area
+        if size is None:
+            stats.nodes += 1
+            stats.cost += ratio * TRAVERSAL_COST
+            continue
+        stats.leaves += 1
+        stats.surfaces += size
+        stats.max_leaf = max(stats.max_leaf, size)
+        stats.max_depth = max(stats.max_depth, depth)
+        stats.cost += ratio * size * INTERSECT_COST
+        depth_total += depth
+    stats.avg_depth = depth_total / stats.leaves
+    stats.avg_leaf = stats.surfaces / stats.leaves
+    return stats
+
+
+def _walk_tree(root):
+    # yield (area, depth, leaf size or None) for each node of a BVH tree
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if type(node) == BVH:
+            yield node.bbox.area, depth, None
+            stack.append((node.left, depth+1))
+            stack.append((node.right, depth+1))
+        else:
+            size = len(node.surfaces) if type(node) == BVHLeaf else 1
+            yield node.bbox.area, depth, size
+
+
+def _walk_flat(flat):
+    # yield (area, depth, leaf size or None) for each node of a FlatBVH
+    stack = [(0, 0)]
+    while stack:
+        i, depth = stack.pop()
+        b = flat.bounds[6*i:6*i+6]
+        area = BoundingBox(b[:3], b[3:]).area
+        second, count, axis = flat.nodes[3*i:3*i+3]
+        if count:
+            yield area, depth, count
+        else:
+            yield area, depth, None
+            stack.append((second, depth+1))
+            stack.append((i+1, depth+1))
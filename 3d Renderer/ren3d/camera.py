@@ -1,12 +1,18 @@
 # camera.py
 #    Implementation of simple camera for describing views
 
+from array import array
 from math import tan, radians
 from ren3d.math3d import Point, Vector
-from ren3d.ray3d import Ray
+from ren3d.ray3d import Ray, _ray
 from ren3d.trans3d import to_uvn
 import ren3d.matrix as mat
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Camera:
     """Camera is used to specify the view of the scene.
@@ -55,6 +61,7 @@ class Camera:
         """ Set resolution of pixel sampling across the window.
         """
         l, b, r, t = self.window
+        self.width, self.height = width, height
         self.dx = (r-l)/width
         self.dy = (t-b)/height
 
@@ -81,6 +88,110 @@ class Camera:
         raydir = x*self.u + y*self.v + z*self.n
         return Ray(self.eye, raydir)
 
+    # The batch methods below step across a row from a precomputed row
+    # origin (the direction through the left edge of the row) by the
+    # per-pixel delta du; dv steps between rows. The rays share the eye
+    # point rather than each getting a copy.
+
+    def _deltas(self):
+        # direction through the bottom left corner, du and dv
+        l, b, r, t = self.window
+        corner = l*self.u + b*self.v + (-self.distance)*self.n
+        return corner, self.dx*self.u, self.dy*self.v
+
+    def row_rays(self, j, i0=0, i1=None, step=1):
+        """ yield the rays through pixels i0 to i1-1 (default: to the
+        end of the row) of row j, or through every step'th of them
+
+        >>> c = Camera()
+        >>> c.set_resolution(400, 300)
+        >>> list(c.row_rays(0, 0, 1))
+        [Ray(Point([0.0, 0.0, 0.0]), Vector([-9.975, -9.966666666666667, -10.0]))]
+        >>> r = list(c.row_rays(150))[200]
+        >>> [round(x, 12) for x in r.dir]
+        [0.025, 0.033333333333, -10.0]
+        >>> [round(r.dir.x, 3) for r in c.row_rays(0, 0, 400, 100)]
+        [-9.975, -4.975, 0.025, 5.025]
+        """
+        if i1 is None:
+            i1 = self.width
+        corner, du, dv = self._deltas()
+        row = corner.madd(j+0.5, dv)
+        eye = self.eye
+        for i in range(i0, i1, step):
+            yield _ray(eye, row.madd(i+0.5, du))
+
+    def tile_rays(self, tile):
+        """ yield (i, j, ray) for the pixels of tile (x0, y0, x1, y1),
+        row by row from the bottom
+
+        >>> c = Camera()
+        >>> c.set_resolution(4, 4)
+        >>> [(i, j) for i, j, ray in c.tile_rays((1, 2, 3, 4))]
+        [(1, 2), (2, 2), (1, 3), (2, 3)]
+        """
+        x0, y0, x1, y1 = tile
+        corner, du, dv = self._deltas()
+        eye = self.eye
+        for j in range(y0, y1):
+            row = corner.madd(j+0.5, dv)
+            for i in range(x0, x1):
+                yield i, j, _ray(eye, row.madd(i+0.5, du))
+
+    def fill_directions(self, tile, buf=None):
+        """ store the ray directions for the pixels of tile, as x, y, z
+        for each pixel row by row from the bottom, into buf (an
+        array("d") that is resized as needed) and return it
+
+        >>> c = Camera()
+        >>> c.set_resolution(2, 2)
+        >>> list(c.fill_directions((0, 0, 2, 1)))
+        [-5.0, -5.0, -10.0, 5.0, -5.0, -10.0]
+        """
+        x0, y0, x1, y1 = tile
+        size = 3 * (x1-x0) * (y1-y0)
+        if buf is None:
+            buf = array("d", bytes(8*size))
+        elif len(buf) != size:
+            buf[:] = array("d", bytes(8*size))
+        corner, du, dv = self._deltas()
+        k = 0
+        for j in range(y0, y1):
+            row = corner.madd(j+0.5, dv)
+            for i in range(x0, x1):
+                s = i+0.5
+                buf[k] = row.x + s*du.x
+                buf[k+1] = row.y + s*du.y
+                buf[k+2] = row.z + s*du.z
+                k += 3
+        return buf
+
+    def tile_directions(self, tile):
+        """ the ray directions for the pixels of tile as a NumPy array of
+        shape (rows, columns, 3). Requires NumPy. The directions are
+        those of tile_rays (the check passes trivially without NumPy):
+
+        >>> c = Camera()
+        >>> c.set_view((1, 2, 3), (0, 0, -5), (0, 1, 0))
+        >>> c.set_resolution(6, 5)
+        >>> tile = (1, 2, 5, 5)
+        >>> numpy is None or all(
+        ...     tuple(c.tile_directions(tile)[j-2, i-1]) == tuple(ray.dir)
+        ...     for i, j, ray in c.tile_rays(tile))
+        True
+        >>> numpy is None or c.tile_directions(tile).shape == (3, 4, 3)
+        True
+        """
+        if numpy is None:
+            raise ImportError("tile_directions requires NumPy")
+        x0, y0, x1, y1 = tile
+        corner, du, dv = self._deltas()
+        s = numpy.arange(x0, x1) + 0.5
+        t = numpy.arange(y0, y1) + 0.5
+        return (numpy.array(tuple(corner))
+                + t[:, None, None] * numpy.array(tuple(dv))
+                + s[None, :, None] * numpy.array(tuple(du)))
+
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,180 @@
+# gif.py
+#    Writing animated GIF files a frame at a time
+#
+# Every frame is reduced to one fixed palette (6 levels of red, 7 of
+# green and 6 of blue) with ordered dithering, so a frame can be written
+# out as soon as it is finished, without seeing the rest of the
+# animation.
+
+import struct
+
+_LEVELS = (6, 7, 6)
+
+# 4x4 Bayer matrix, for the dithering thresholds
+_BAYER = (0, 8, 2, 10,
+          12, 4, 14, 6,
+          3, 11, 1, 9,
+          15, 7, 13, 5)
+
+
+def _make_palette():
+    nr, ng, nb = _LEVELS
+    colors = bytearray()
+    for r in range(nr):
+        for g in range(ng):
+            for b in range(nb):
+                colors += bytes((round(r*255/(nr-1)), round(g*255/(ng-1)),
+                                 round(b*255/(nb-1))))
+    return bytes(colors) + bytes(3*256 - len(colors))
+
+
+def _make_tables():
+    # tables[t][c][v]: the part of the palette index for value v of
+    # channel c at dithering threshold t
+    nr, ng, nb = _LEVELS
+    weights = (ng*nb, nb, 1)
+    tables = []
+    for t in _BAYER:
+        threshold = (t + .5) / 16
+        channels = []
+        for levels, weight in zip(_LEVELS, weights):
+            table = []
+            for v in range(256):
+                x = v * (levels-1) / 255
+                q = int(x)
+                if x - q > threshold:
+                    q += 1
+                table.append(q * weight)
+            channels.append(table)
+        tables.append(channels)
+    return tables
+
+
+PALETTE = _make_palette()
+_TABLES = _make_tables()
+
+
+def quantize(pixels, size):
+    """ return the palette indices (a bytes object) for pixels, a
+    sequence of r, g, b values, row by row from the top
+
+    >>> quantize(bytes([0, 0, 0, 255, 255, 255]), (2, 1))
+    b'\\x00\\xfb'
+    >>> PALETTE[3*251:3*252]
+    b'\\xff\\xff\\xff'
+    """
+    w, h = size
+    out = bytearray(w*h)
+    k = 0
+    for y in range(h):
+        row = _TABLES[4*(y % 4):4*(y % 4)+4]
+        for x in range(w):
+            tr, tg, tb = row[x % 4]
+            out[k] = tr[pixels[3*k]] + tg[pixels[3*k+1]] + tb[pixels[3*k+2]]
+            k += 1
+    return bytes(out)
+
+
+def lzw_encode(indices, mincode=8):
+    """ return the GIF LZW compressed data for a sequence of color
+    indices, using mincode bit indices """
+    clear = 1 << mincode
+    end = clear + 1
+    out = bytearray()
+    bits = 0            # pending output bits
+    nbits = 0
+    codesize = mincode + 1
+    table = {}
+    nextcode = end + 1
+
+    bits |= clear << nbits
+    nbits += codesize
+    it = iter(indices)
+    prefix = next(it, None)
+    if prefix is None:
+        bits |= end << nbits
+        nbits += codesize
+        return _flush(out, bits, nbits)
+    for c in it:
+        key = prefix << 8 | c
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        bits |= prefix << nbits
+        nbits += codesize
+        while nbits >= 8:
+            out.append(bits & 255)
+            bits >>= 8
+            nbits -= 8
+        if nextcode < 4096:
+            table[key] = nextcode
+            if nextcode == 1 << codesize:
+                codesize += 1
+            nextcode += 1
+        else:
+            # table full: start again
+            bits |= clear << nbits
+            nbits += codesize
+            table = {}
+            codesize = mincode + 1
+            nextcode = end + 1
+        prefix = c
+    bits |= prefix << nbits
+    nbits += codesize
+    bits |= end << nbits
+    nbits += codesize
+    return _flush(out, bits, nbits)
+
+
+def _flush(out, bits, nbits):
+    while nbits > 0:
+        out.append(bits & 255)
+        bits >>= 8
+        nbits -= 8
+    return bytes(out)
+
+
+def _blocks(data):
+    # data as GIF sub-blocks, with the terminator
+    chunks = [bytes((len(data[i:i+255]),)) + data[i:i+255]
+              for i in range(0, len(data), 255)]
+    return b"".join(chunks) + b"\0"
+
+
+class GIFWriter:
+    """An animated GIF file of images of the given size, written a frame
+    at a time. delay is the time each frame is shown, in seconds; the
+    animation loops forever unless loop is False.
+    """
+
+    def __init__(self, fname, size, delay=.1, loop=True):
+        self.size = size
+        self.delay = delay
+        self.file = open(fname, "wb")
+        w, h = size
+        # header, screen descriptor with the global color table
+        self.file.write(b"GIF89a" + struct.pack("<HHBBB", w, h, 0xf7, 0, 0)
+                        + PALETTE)
+        if loop:
+            self.file.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01\0\0\0")
+
+    def add(self, img):
+        """ append the image img (an image.Image) as the next frame """
+        w, h = self.size
+        assert img.size == self.size
+        indices = quantize(img.pixels, self.size)
+        ticks = round(self.delay * 100)
+        self.file.write(b"\x21\xf9\x04" + struct.pack("<BHBB", 0, ticks, 0, 0))
+        self.file.write(b"\x2c" + struct.pack("<HHHHB", 0, 0, w, h, 0))
+        self.file.write(b"\x08" + _blocks(lzw_encode(indices)))
+
+    def close(self):
+        self.file.write(b"\x3b")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -3,6 +3,7 @@
 
 
 import array
+from multiprocessing import shared_memory
 
 # needed for img.show()
 from ren3d import ppmview
@@ -76,6 +77,29 @@ class Image:
             pixels[base+1] = g
             pixels[base+2] = b
 
+    def set_tile(self, tile, data):
+        """ Set the colors of every pixel in a rectangular tile
+        tile is (x0, y0, x1, y1), covering pixels x0 <= x < x1 and
+            y0 <= y < y1
+        data is a bytes-like sequence of r, g, b values for the pixels
+            of the tile, row by row starting with row y0.
+
+        >>> img = Image((3, 2))
+        >>> img.set_tile((1, 0, 3, 2), bytes(range(12)))
+        >>> img[1, 0], img[2, 0], img[1, 1], img[2, 1]
+        ((0, 1, 2), (3, 4, 5), (6, 7, 8), (9, 10, 11))
+        >>> img[0, 0]
+        (0, 0, 0)
+        """
+        x0, y0, x1, y1 = tile
+        rowlen = 3*(x1-x0)
+        pixels = self.pixels
+        data = memoryview(data)
+        for row, j in enumerate(range(y0, y1)):
+            base = self._base((x0, j))
+            pixels[base:base+rowlen] = array.array(
+                "B", data[row*rowlen:(row+1)*rowlen])
+
     def __getitem__(self, pos):
         """ Get the color of a pixel
         pos is a pair (x, y) giving the pixel location--origin in lower left
@@ -149,6 +173,49 @@ class Image:
             self.viewer = None
 
 
+class SharedImage(Image):
+
+    """Image whose pixels live in shared memory, so that other processes
+    can attach to it by name and set pixels directly.
+
+    >>> img = SharedImage((4, 3))
+    >>> other = SharedImage((4, 3), img.name)   # e.g. in another process
+    >>> other[1, 2] = (255, 0, 0)
+    >>> img[1, 2]
+    (255, 0, 0)
+    >>> other.close()
+    >>> img.close()
+    """
+
+    def __init__(self, size, name=None):
+        """Create a blank shared image of the given size, or attach to
+        the existing shared image called name.
+        """
+        width, height = size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True,
+                                                  size=3*width*height)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = name is None
+        self.size = (width, height)
+        self.pixels = self.shm.buf[:3*width*height]
+        self.viewer = None
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        """ detach from the shared pixels (and free them if this image
+        created them). The image can no longer be used.
+        """
+        self.pixels.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
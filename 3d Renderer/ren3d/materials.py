@@ -7,6 +7,10 @@ from ren3d.rgb import RGB
 
 class Material(object):
 
+    # colors are stored as RGB, ready for RGB.scale_add in the shader
+    __slots__ = ("_diffuse", "_ambient", "_specular", "_shininess",
+                 "_reflect")
+
     def __init__(self, diffuse,          # diffuse (Lambert) coefficients (req.)
                  ambient=None,           # ambient coefficients
                  specular=(.5, .5, .5),  # specular reflection coefficients
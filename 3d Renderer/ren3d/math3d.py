@@ -1,58 +1,79 @@
 # math3d.py
 # implementation of points and vectors in 3-space
+#
+# Points and Vectors store their coordinates in three slots (x, y, z) and
+# the arithmetic is written out per coordinate, since these objects are
+# created millions of times per image. The fused helpers (madd, sub_dot)
+# and in-place methods (iadd, imadd, iscale) avoid temporaries in the
+# inner loops of the renderer.
 
 
 from math import sqrt
 import ren3d.matrix as mat
 
+
+def _xyz(coords):
+    # floats x, y, z from a sequence of 2 or 3 coordinates (z defaults to 0)
+    coords = tuple(coords)
+    if len(coords) == 2:
+        return float(coords[0]), float(coords[1]), 0.0
+    x, y, z = coords
+    return float(x), float(y), float(z)
+
+
+def _point(x, y, z):
+    # fast construction from floats
+    p = _new(Point)
+    p.x = x
+    p.y = y
+    p.z = z
+    return p
+
+
+def _vector(x, y, z):
+    # fast construction from floats
+    v = _new(Vector)
+    v.x = x
+    v.y = y
+    v.z = z
+    return v
+
+
+_new = object.__new__
+
+
 class Point:
-    """A location in 2- or 3-space
+    """A location in 2- or 3-space (2D points have z = 0)
 
     """
 
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, coords):
         """ A point in 2- or 3-space
         >>> p2 = Point([1,2])
         >>> p3 = Point([1,2,3])
         """
-        self._coords = [float(v) for v in coords]
+        self.x, self.y, self.z = _xyz(coords)
 
     def __repr__(self):
-        """ 
+        """
         >>> Point([1,2,3])
         Point([1.0, 2.0, 3.0])
         """
-        return "Point(" + str(self._coords) + ")"
-
-    @property
-    def x(self):
-        return self._coords[0]
-
-    @x.setter
-    def x(self, v):
-        self._coords[0] = float(v)
-
-    @property
-    def y(self):
-        return self._coords[1]
-
-    @y.setter
-    def y(self, v):
-        self._coords[1] = float(v)
-
-    @property
-    def z(self):
-        return self._coords[2]
-
-    @z.setter
-    def z(self, v):
-        self._coords[2] = float(v)
+        return "Point([{!r}, {!r}, {!r}])".format(self.x, self.y, self.z)
 
     def __getitem__(self, i):
-        return self._coords[i]
+        if i == 0:
+            return self.x
+        if i == 1:
+            return self.y
+        if i == 2:
+            return self.z
+        return (self.x, self.y, self.z)[i]
 
     def __setitem__(self, i, value):
-        self._coords[i] = float(value)
+        setattr(self, ("x", "y", "z")[i], float(value))
 
     def __iter__(self):
         """ Point is a sequence of its coordinates
@@ -69,79 +90,84 @@ class Point:
         >>> x, y, z
         (1.0, 2.0, 3.0)
         """
-        return iter(self._coords)
+        return iter((self.x, self.y, self.z))
 
     def __sub__(self, other):
         """ Difference of Point with another Point or a Vector
 
         A point minus a point produces a vector.
         A point minus a vector produces a point.
-        
+
        >>> Point([1,2,3]) - Point([5,-3,2])
        Vector([-4.0, 5.0, 1.0])
         >>> Point([1,2,3]) - Vector([5,-3,2])
         Point([-4.0, 5.0, 1.0])
-        >>> 
+        >>>
+
+        """
+        make = _vector if type(other) == Point else _point
+        return make(self.x-other.x, self.y-other.y, self.z-other.z)
 
+    def __add__(self, other):
+        """ Point plus a Vector
+
+        >>> Point([1,2,3]) + Vector([4,5,6])
+        Point([5.0, 7.0, 9.0])
+        """
+        return _point(self.x+other.x, self.y+other.y, self.z+other.z)
+
+    def madd(self, s, v):
+        """ return self + s*v for scalar s and Vector v
+
+        >>> Point([1,2,3]).madd(2, Vector([1,0,-1]))
+        Point([3.0, 2.0, 1.0])
+        """
+        return _point(self.x+s*v.x, self.y+s*v.y, self.z+s*v.z)
+
+    def sub_dot(self, other, v):
+        """ return (self - other).dot(v) without making the difference
+
+        >>> Point([1,2,3]).sub_dot(Point([0,0,1]), Vector([1,1,1]))
+        5.0
         """
-        restype = Vector if type(other) == Point else Point
-        return restype([a-b for a, b in zip(self, other)])
+        return ((self.x-other.x)*v.x + (self.y-other.y)*v.y
+                + (self.z-other.z)*v.z)
 
     def transform(self, trans):
-        #print("trans", trans)
-        coords1 = mat.apply(trans, self._coords+[1.0])
+        """ apply trans, a 4x4 matrix or trans3d.Affine """
+        if type(trans) is not list:
+            return trans.apply_point(self)
+        coords1 = mat.apply(trans, [self.x, self.y, self.z, 1.0])
         return Point(coords1[:3])
 
 
 
 class Vector:
-    """A vector in 2- or 3-space
+    """A vector in 2- or 3-space (2D vectors have z = 0)
     """
 
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, coords):
         """
         >>> v1 = Vector([1, 2, 3])
         >>> v2 = Vector([4.3, 5.2])
         """
-        self._coords = [float(v) for v in coords]
+        self.x, self.y, self.z = _xyz(coords)
 
     def __repr__(self):
         """
         >>> Vector([1,2,3])
         Vector([1.0, 2.0, 3.0])
         """
-        return "Vector(" + str(self._coords) + ")"
-
-    @property
-    def x(self):
-        return self._coords[0]
-
-    @x.setter
-    def x(self, v):
-        self._coords[0] = float(v)
-
-    @property
-    def y(self):
-        return self._coords[1]
-
-    @y.setter
-    def y(self, v):
-        self._coords[1] = float(v)
-
-    @property
-    def z(self):
-        return self._coords[2]
-
-    @z.setter
-    def z(self, v):
-        self._coords[2] = float(v)
+        return "Vector([{!r}, {!r}, {!r}])".format(self.x, self.y, self.z)
 
     def __iter__(self):
         """
         >>> list(Vector([1,2,3]))
         [1.0, 2.0, 3.0]
         """
-        return iter(self._coords)
+        return iter((self.x, self.y, self.z))
 
     def __getitem__(self, i):
         """
@@ -150,12 +176,18 @@ class Vector:
         1.0
         >>> v[2]
         5.0
-        
+
         """
-        return self._coords[i]
+        if i == 0:
+            return self.x
+        if i == 1:
+            return self.y
+        if i == 2:
+            return self.z
+        return (self.x, self.y, self.z)[i]
 
     def __setitem__(self, i, v):
-        """ set ith item 
+        """ set ith item
 
         >>> v = Vector((1, 3, 5))
         >>> v[1] = 4
@@ -164,7 +196,7 @@ class Vector:
 
         """
 
-        self._coords[i] = float(v)
+        setattr(self, ("x", "y", "z")[i], float(v))
 
     def __rmul__(self, s):
         """ multiplication by a preceeding scalar
@@ -172,15 +204,15 @@ class Vector:
         >>> 3 * Vector([1,2,3])
         Vector([3.0, 6.0, 9.0])
         """
-        return Vector(s*v for v in self)
+        return _vector(s*self.x, s*self.y, s*self.z)
 
     def __mul__(self, s):
         """ multiplication by a succeeding scalar
         >>> Vector([1,2,3]) * 3
         Vector([3.0, 6.0, 9.0])
         """
-        return Vector(s*v for v in self)
-    
+        return _vector(s*self.x, s*self.y, s*self.z)
+
     def __add__(self, other):
         """ vector addition with other on right
         the result type depends on other: vector + point --> point
@@ -191,8 +223,8 @@ class Vector:
         >>> Vector([3, -1, 2]) + Vector([1, 2, 3])
         Vector([4.0, 1.0, 5.0])
         """
-        res_type = type(other)
-        return res_type(a+b for a, b in zip(self, other))
+        make = _point if type(other) == Point else _vector
+        return make(self.x+other.x, self.y+other.y, self.z+other.z)
 
     def __radd__(self, other):
         """ vector addition with other on left (see __add__)
@@ -200,22 +232,22 @@ class Vector:
         >>> Point([1,2,3]) + Vector([4,5,6])
         Point([5.0, 7.0, 9.0])
         """
-        res_type = type(other)
-        return res_type(a+b for a, b in zip(self, other))
+        make = _point if type(other) == Point else _vector
+        return make(other.x+self.x, other.y+self.y, other.z+self.z)
 
     def __neg__(self):
         """negation
         >>> -Vector([1,-2,3])
         Vector([-1.0, 2.0, -3.0])
         """
-        return Vector(-a for a in self)
+        return _vector(-self.x, -self.y, -self.z)
 
     def __sub__(self, other):
         """vector subtraction
         >>> Vector([1,2,3]) - Vector([-3,1,2.5])
         Vector([4.0, 1.0, 0.5])
         """
-        return Vector(a-b for a,b in zip(self, other))
+        return _vector(self.x-other.x, self.y-other.y, self.z-other.z)
 
     def dot(self, other):
         """ Vector dot product
@@ -223,7 +255,7 @@ class Vector:
         >>> Vector([1,2,3]).dot(Vector([2,3,4]))
         20.0
         """
-        return sum(a*b for a,b in zip(self,other))
+        return self.x*other.x + self.y*other.y + self.z*other.z
 
     def cross(self, other):
         """ Vector cross product
@@ -231,9 +263,9 @@ class Vector:
         >>> Vector([1,2,3]).cross(Vector([4,5,6]))
         Vector([-3.0, 6.0, -3.0])
         """
-        ax, ay, az = self._coords
-        bx, by, bz = other._coords
-        return Vector((ay*bz-by*az, az*bx-ax*bz, ax*by-ay*bx))
+        ax, ay, az = self.x, self.y, self.z
+        bx, by, bz = other.x, other.y, other.z
+        return _vector(ay*bz-by*az, az*bx-ax*bz, ax*by-ay*bx)
 
     def mag2(self):
         """ Square of magnitude
@@ -241,14 +273,16 @@ class Vector:
         >>> Vector([1,2,3]).mag2()
         14.0
         """
-        return self.dot(self)
+        x, y, z = self.x, self.y, self.z
+        return x*x + y*y + z*z
 
     def mag(self):
         """ Magnitude
         >>> Vector([1,2,3]).mag()
         3.7416573867739413
         """
-        return sqrt(self.dot(self))
+        x, y, z = self.x, self.y, self.z
+        return sqrt(x*x + y*y + z*z)
 
     def normalize(self):
         """ make this vector unit length
@@ -259,8 +293,9 @@ class Vector:
         Vector([0.2672612419124244, 0.5345224838248488, 0.8017837257372732])
         """
         m = self.mag()
-        for i in range(len(self._coords)):
-            self._coords[i] /= m
+        self.x /= m
+        self.y /= m
+        self.z /= m
 
     def normalized(self):
         """ return normalized version of this vector
@@ -270,13 +305,72 @@ class Vector:
         >>> v
         Vector([1.0, 2.0, 3.0])
         """
-        return 1/self.mag() * self
+        s = 1/self.mag()
+        return _vector(s*self.x, s*self.y, s*self.z)
 
     def reflection(self, normal):
-        return self - 2*(self.dot(normal))*normal
+        s = 2*self.dot(normal)
+        return _vector(self.x-s*normal.x, self.y-s*normal.y,
+                       self.z-s*normal.z)
+
+    def madd(self, s, other):
+        """ return self + s*other for scalar s and Vector other
+
+        >>> Vector([1,2,3]).madd(.5, Vector([2,2,2]))
+        Vector([2.0, 3.0, 4.0])
+        """
+        return _vector(self.x+s*other.x, self.y+s*other.y, self.z+s*other.z)
+
+    def sub_dot(self, other, v):
+        """ return (self - other).dot(v) without making the difference
+
+        >>> Vector([1,2,3]).sub_dot(Vector([1,1,1]), Vector([0,1,2]))
+        5.0
+        """
+        return ((self.x-other.x)*v.x + (self.y-other.y)*v.y
+                + (self.z-other.z)*v.z)
+
+    def iadd(self, other):
+        """ add other into this vector
+
+        >>> v = Vector([1,2,3])
+        >>> v.iadd(Vector([1,1,1]))
+        >>> v
+        Vector([2.0, 3.0, 4.0])
+        """
+        self.x += other.x
+        self.y += other.y
+        self.z += other.z
+
+    def imadd(self, s, other):
+        """ add s*other into this vector
+
+        >>> v = Vector([1,2,3])
+        >>> v.imadd(2, Vector([1,0,1]))
+        >>> v
+        Vector([3.0, 2.0, 5.0])
+        """
+        self.x += s*other.x
+        self.y += s*other.y
+        self.z += s*other.z
+
+    def iscale(self, s):
+        """ scale this vector by s
+
+        >>> v = Vector([1,2,3])
+        >>> v.iscale(2)
+        >>> v
+        Vector([2.0, 4.0, 6.0])
+        """
+        self.x *= s
+        self.y *= s
+        self.z *= s
 
     def transform(self, trans):
-        coords1 = mat.apply(trans, self._coords+[0.0])
+        """ apply trans, a 4x4 matrix or trans3d.Affine """
+        if type(trans) is not list:
+            return trans.apply_vector(self)
+        coords1 = mat.apply(trans, [self.x, self.y, self.z, 0.0])
         return Vector(coords1[:3])
 
 
@@ -1,10 +1,15 @@
 # mesh.py
 #    tools for handling meshes from OFF files.
 
+from array import array
+from math import acos, sqrt
+
 from ren3d.math3d import Point, Vector
 from ren3d.bbox import BoundingBox
 from ren3d.materials import make_material
-from ren3d.models import Group, Record
+from ren3d.models import Record
+from ren3d.bvh import build_index_BVH, FlatBVH
+from ren3d import meshcache
 
 class Triangle:
 
@@ -29,8 +34,26 @@ class Triangle:
                      color=self.color, normals=self.normals)
 
     def intersect(self, ray, interval, info):
-        if not self.bbox.hit(ray, interval):
+        hit = self._hit(ray, interval)
+        if hit is None:
             return False
+        t, beta, gamma = hit
+        info.t = t
+        info.point = ray.point_at(t)
+        info.color = self.color
+        n0, n1, n2 = self.normals
+        info.normal = (1 - beta - gamma)*n0 + beta*n1 + gamma*n2
+        info.normal.normalize()
+        info.texture = None
+        return True
+
+    def occluded(self, ray, interval):
+        return self._hit(ray, interval) is not None
+
+    def _hit(self, ray, interval):
+        # (t, beta, gamma) of the hit within interval, or None
+        if not self.bbox.hit(ray, interval):
+            return None
         p0, p1, p2 = self.points
         a, b, c = p0 - p1
         d, e, f = p0 - p2
@@ -42,7 +65,7 @@ class Triangle:
 
         den = a*ei_hf + b*gf_di + c*dh_eg
         if den == 0:
-            return False
+            return None
 
         j, k, l = p0 - ray.start
         bl_kc = b*l - k*c
@@ -51,77 +74,382 @@ class Triangle:
 
         t = -(d*bl_kc + e*jc_al + f*ak_jb) / den
         if t not in interval:
-            return False
+            return None
 
         beta = (j*ei_hf + k*gf_di + l*dh_eg) / den
         if beta < 0 or beta > 1:
-            return False
+            return None
 
         gamma = (g*bl_kc + h*jc_al + i*ak_jb) / den
         if gamma < 0 or gamma + beta > 1:
-            return False
+            return None
 
-        info.t = t
-        info.point = ray.point_at(t)
-        info.color = self.color
-        n0, n1, n2 = self.normals
-        info.normal = (1 - beta - gamma)*n0 + beta*n1 + gamma*n2
-        info.normal.normalize()
-        info.texture = None
-
-        return True
+        return t, beta, gamma
 
 
 class Mesh:
 
-    def __init__(self, fname, color, recenter=False, smooth=False):
-        meshdata = OFFData(fname)
+    def __init__(self, fname, color, recenter=False, smooth=False, bvh="sah",
+                 weighting=None, cache=True):
+        """ mesh of triangles read from OFF file fname. The triangles
+        are packed into a TriangleStore and organized into a BVH built
+        with method bvh (see bvh.BUILDERS); with bvh None every triangle
+        is tested in turn. weighting is passed on to OFFData for
+        computing smooth vertex normals. When cache is True, the parsed
+        mesh and its BVH are kept in the mesh cache (see meshcache).
+        """
+        meshdata = OFFData(fname, weighting, cache)
         if recenter:
             meshdata.recenter()
 
-        group = Group()
-        for tri in _make_mesh_triangles(meshdata, color, smooth):
-            group.add(tri)
-        self.group = group
+        self.store = TriangleStore(meshdata, color, smooth)
+        self.method = bvh
+        entry = "bvh-{}{}".format(bvh, "-recenter" if recenter else "")
+        arrays = meshcache.load("meshes/"+fname, entry) if cache else None
+        if arrays and not _fits_bvh(arrays, len(self.store)):
+            arrays = None
+        self.surface = TriangleBVH(self.store, bvh, arrays)
+        if cache and not arrays:
+            meshcache.save("meshes/"+fname, entry, self.surface.arrays())
         self.bbox = meshdata.bbox
 
+    def transformed(self, trans):
+        """ a copy of this mesh with its triangles moved by trans (a
+        trans3d.Affine). The copy gets its own BVH, which is not cached.
+        """
+        mesh = object.__new__(Mesh)
+        mesh.store = self.store.transformed(trans)
+        mesh.method = self.method
+        mesh.surface = TriangleBVH(mesh.store, self.method)
+        mesh.bbox = mesh.surface.bbox
+        return mesh
+
     def iter_polygons(self):
-        return self.group.iter_polygons()
+        return self.store.iter_polygons()
 
     def intersect(self, ray, interval, info):
-        if not self.bbox.hit(ray, interval):
+        # the BVH checks the mesh bounds first
+        return self.surface.intersect(ray, interval, info)
+
+    def occluded(self, ray, interval):
+        return self.surface.occluded(ray, interval)
+
+
+class TriangleStore:
+    """The triangles of a mesh packed into flat arrays.
+
+    verts holds x, y, z for each vertex and normals x, y, z for each
+    (unit) normal. For each triangle, faces holds 3 vertex indexes,
+    nindexes 3 normal indexes (one per corner) and edges the 6 components
+    of the edge vectors p0-p1 and p0-p2, which are computed once here
+    rather than on every intersection test.
+    """
+
+    def __init__(self, data, color, smooth):
+        self.color = make_material(color)
+        coords, sizes, indexes, f_norms, v_norms = data.arrays()
+        self.verts = array("d", coords)
+        self.normals = _units(v_norms if smooth else f_norms)
+
+        self.faces = array("i")
+        self.nindexes = array("i")
+        start = 0
+        for face_i, size in enumerate(sizes):
+            face = indexes[start:start+size]
+            start += size
+            corners = face if smooth else [face_i]*size
+            # triangle fan around the first vertex
+            for i in range(1, size-1):
+                self.faces.extend((face[0], face[i], face[i+1]))
+                self.nindexes.extend((corners[0], corners[i], corners[i+1]))
+        self._make_edges()
+
+    def _make_edges(self):
+        verts = self.verts
+        self.edges = array("d")
+        for i in range(0, len(self.faces), 3):
+            v0, v1, v2 = [3*v for v in self.faces[i:i+3]]
+            for axis in range(3):
+                self.edges.append(verts[v0+axis] - verts[v1+axis])
+            for axis in range(3):
+                self.edges.append(verts[v0+axis] - verts[v2+axis])
+
+    def transformed(self, trans):
+        """ a copy of this store with vertices and normals transformed by
+        trans (a trans3d.Affine); faces are shared with this store """
+        store = object.__new__(TriangleStore)
+        store.color = self.color
+        store.faces, store.nindexes = self.faces, self.nindexes
+        store.verts = array("d")
+        verts = self.verts
+        for v in range(0, len(verts), 3):
+            store.verts.extend(trans.apply_point(Point(verts[v:v+3])))
+        store.normals = array("d")
+        ntrans, normals = trans.normal(), self.normals
+        for n in range(0, len(normals), 3):
+            normal = ntrans.apply_vector(Vector(normals[n:n+3]))
+            store.normals.extend(_unit(normal))
+        store._make_edges()
+        return store
+
+    def __len__(self):
+        return len(self.faces) // 3
+
+    def boxes(self):
+        """ return a list of (lx, ly, lz, hx, hy, hz) bounds, one for
+        each triangle"""
+        verts, faces = self.verts, self.faces
+        boxes = []
+        for i in range(0, len(faces), 3):
+            xs, ys, zs = zip(*[verts[3*v:3*v+3] for v in faces[i:i+3]])
+            boxes.append((min(xs), min(ys), min(zs),
+                          max(xs), max(ys), max(zs)))
+        return boxes
+
+    def iter_polygons(self):
+        verts, normals = self.verts, self.normals
+        for i in range(0, len(self.faces), 3):
+            points = [Point(verts[3*v:3*v+3]) for v in self.faces[i:i+3]]
+            norms = [Vector(normals[3*n:3*n+3])
+                     for n in self.nindexes[i:i+3]]
+            yield Record(points=points, color=self.color, normals=norms)
+
+    def intersect(self, triangles, ray, interval, info):
+        """ intersect ray with the triangles (a sequence of indexes),
+        recording the closest hit inside interval into info"""
+        closest = self._search(triangles, ray, interval.low, interval.high,
+                               False)
+        if closest is None:
             return False
-        return self.group.intersect(ray, interval, info)
+        interval.high = closest[0]
+        self._setinfo(ray, closest, info)
+        return True
+
+    def occluded(self, triangles, ray, interval):
+        """ True iff ray hits any of the triangles inside interval """
+        return self._search(triangles, ray, interval.low, interval.high,
+                            True) is not None
+
+    def _search(self, triangles, ray, low, high, anyhit):
+        # (t, triangle, beta, gamma) of the closest hit between low and
+        # high, or of the first one found if anyhit; None if no hit
+        verts, faces, edges = self.verts, self.faces, self.edges
+        sx, sy, sz = ray.start
+        g, h, i = ray.dir
+        closest = None
+        for tri in triangles:
+            m = 6*tri
+            a, b, c, d, e, f = edges[m:m+6]
+
+            ei_hf = e*i - h*f
+            gf_di = g*f - d*i
+            dh_eg = d*h - e*g
+
+            den = a*ei_hf + b*gf_di + c*dh_eg
+            if den == 0:
+                continue
+
+            v = 3*faces[3*tri]
+            j, k, l = verts[v]-sx, verts[v+1]-sy, verts[v+2]-sz
+            bl_kc = b*l - k*c
+            jc_al = j*c - a*l
+            ak_jb = a*k - j*b
+
+            t = -(d*bl_kc + e*jc_al + f*ak_jb) / den
+            if not low < t < high:
+                continue
+
+            beta = (j*ei_hf + k*gf_di + l*dh_eg) / den
+            if beta < 0 or beta > 1:
+                continue
+
+            gamma = (g*bl_kc + h*jc_al + i*ak_jb) / den
+            if gamma < 0 or gamma + beta > 1:
+                continue
+
+            high = t
+            closest = t, tri, beta, gamma
+            if anyhit:
+                break
+        return closest
+
+    def _setinfo(self, ray, closest, info):
+        # helper method to fill in the info record
+        t, tri, beta, gamma = closest
+        normals = self.normals
+        n0, n1, n2 = [3*n for n in self.nindexes[3*tri:3*tri+3]]
+        alpha = 1 - beta - gamma
+        info.t = t
+        info.point = ray.point_at(t)
+        info.color = self.color
+        info.normal = Vector([alpha*normals[n0+axis] + beta*normals[n1+axis]
+                              + gamma*normals[n2+axis] for axis in range(3)])
+        info.normal.normalize()
+        info.texture = None
+
 
+class TriangleBVH(FlatBVH):
+    """FlatBVH whose primitives are triangle indexes into a TriangleStore"""
 
-def _make_mesh_triangles(data, color, smooth):
-    """ yield Triangle objects for all faces of mesh in data"""
-    color = make_material(color)
-    for face in data.face_indexes:
-        points = data.get_points(face)
-        if smooth:
-            normals = data.get_vertex_normals(face)
+    def __init__(self, store, method="sah", arrays=None):
+        """ BVH built over the triangles of store using method, or
+        restored from arrays previously returned by the arrays method.
+        """
+        if arrays:
+            self.bounds, self.nodes, self.prims = arrays
+            self._make_bbox()
         else:
-            normals = [data.get_face_normal(face)]*len(points)
-        for i in range(len(points)-1):
-            tri = Triangle([points[0], points[i], points[i+1]],
-                           color,
-                           [normals[0], normals[i], normals[i+1]])
-            yield tri
+            super().__init__(build_index_BVH(store.boxes(), method))
+            self.prims = array("i", self.prims)
+        self.store = store
 
+    def arrays(self):
+        return [self.bounds, self.nodes, self.prims]
+
+    def iter_polygons(self):
+        return self.store.iter_polygons()
+
+    def intersect_prims(self, first, count, ray, interval, info):
+        return self.store.intersect(self.prims[first:first+count],
+                                    ray, interval, info)
+
+    def occluded_prims(self, first, count, ray, interval):
+        return self.store.occluded(self.prims[first:first+count],
+                                   ray, interval)
+
+
+def _fits_bvh(arrays, ntriangles):
+    # True iff arrays from the mesh cache make a usable TriangleBVH over
+    # ntriangles triangles: every node's children and primitives exist
+    if [a.typecode for a in arrays] != ["d", "i", "i"]:
+        return False
+    bounds, nodes, prims = arrays
+    nnodes = len(nodes) // 3
+    if (nnodes == 0 or len(nodes) != 3*nnodes or len(bounds) != 6*nnodes
+            or (prims and (min(prims) < 0 or max(prims) >= ntriangles))):
+        return False
+    for i in range(nnodes):
+        first, count = nodes[3*i], nodes[3*i+1]
+        if count:
+            if first < 0 or first+count > len(prims):
+                return False
+        elif not i+1 < first < nnodes:
+            return False
+    return True
+
+
+def _unit(n):
+    # components of n scaled to unit length (zero vectors are left alone)
+    mag = n.mag()
+    if mag == 0:
+        return tuple(n)
+    return tuple(v/mag for v in n)
+
+
+def _units(coords):
+    # array of the vectors in coords (x, y, z for each), each scaled to
+    # unit length as by _unit
+    units = array("d", coords)
+    for i in range(0, len(units), 3):
+        x, y, z = units[i:i+3]
+        mag = sqrt(x*x + y*y + z*z)
+        if mag != 0:
+            units[i:i+3] = array("d", (x/mag, y/mag, z/mag))
+    return units
 
-class OFFData:
-    """Class for reading OFF files and supplying face information"""
 
-    def __init__(self, fname):
-        points, faces = self._readOFF("meshes/"+fname)
-        self.points = points
-        self.faces = faces
-        self.face_indexes = range(len(faces))
+def _vectors(coords):
+    # list of the Vectors in coords (x, y, z for each)
+    return [Vector(coords[i:i+3]) for i in range(0, len(coords), 3)]
+
+
+def _fits(arrays):
+    # True iff arrays from the mesh cache are consistent enough to use:
+    # whole points and normals, and faces that index existing vertices
+    if [a.typecode for a in arrays] != ["d", "i", "i", "d", "d"]:
+        return False
+    coords, sizes, indexes, f_norms, v_norms = arrays
+    return (len(coords) % 3 == 0 and len(v_norms) == len(coords)
+            and len(f_norms) == 3*len(sizes)
+            and sum(sizes) == len(indexes)
+            and (not sizes or min(sizes) >= 3)
+            and (not indexes or (min(indexes) >= 0
+                                 and max(indexes) < len(coords)//3)))
+
+
+class OFFData:
+    """Class for reading OFF files and supplying face information
+
+    Vertex normals are the normalized sum of the normals of the faces
+    around the vertex. weighting selects how each face contributes:
+    None (equally), "area" (by face area) or "angle" (by the angle of
+    the face at the vertex).
+
+    The data is kept in flat arrays (see arrays); the points, faces and
+    normals as objects are only made when first asked for, so a mesh
+    loaded from the cache never makes them.
+    """
+
+    def __init__(self, fname, weighting=None, cache=True):
+        source = "meshes/"+fname
+        entry = "off-{}".format(weighting or "equal")
+        arrays = meshcache.load(source, entry) if cache else None
+        if arrays and _fits(arrays):
+            self._arrays = arrays
+            self._points = self._faces = None
+            self._f_norms = self._v_norms = None
+        else:
+            self._points, self._faces = self._readOFF(source)
+            self._f_norms = [self._compute_face_normal(f) for f in self.faces]
+            self._v_norms = self._compute_vertex_normals(weighting)
+            self._arrays = self._to_arrays()
+            if cache:
+                meshcache.save(source, entry, self._arrays)
+        self.face_indexes = range(len(self._arrays[1]))
         self.bbox = self._make_bbox()
-        self._f_norms = [self._compute_face_normal(f) for f in faces]
-        self._v_norms = [self._compute_vertex_normal(i)
-                         for i in range(len(self.points))]
+
+    def arrays(self):
+        """ return the mesh as flat arrays: vertex coordinates (x, y, z
+        for each vertex), the number of vertices of each face, the vertex
+        indexes of all the faces one after another, and the face normals
+        and vertex normals (x, y, z for each) """
+        return self._arrays
+
+    def _to_arrays(self):
+        # pack the mesh data into flat arrays
+        coords = array("d")
+        for p in self._points:
+            coords.extend(p)
+        sizes = array("i", [len(f) for f in self._faces])
+        indexes = array("i")
+        for f in self._faces:
+            indexes.extend(f)
+        f_norms = array("d")
+        for n in self._f_norms:
+            f_norms.extend(n)
+        v_norms = array("d")
+        for n in self._v_norms:
+            v_norms.extend(n)
+        return [coords, sizes, indexes, f_norms, v_norms]
+
+    @property
+    def points(self):
+        if self._points is None:
+            coords = self._arrays[0]
+            self._points = [Point(coords[i:i+3])
+                            for i in range(0, len(coords), 3)]
+        return self._points
+
+    @property
+    def faces(self):
+        if self._faces is None:
+            sizes, indexes = self._arrays[1:3]
+            self._faces = []
+            start = 0
+            for size in sizes:
+                self._faces.append(tuple(indexes[start:start+size]))
+                start += size
+        return self._faces
 
     def _readOFF(self, fname):
         # Read data from OFF file, return vertices and facelists
@@ -142,9 +470,11 @@ class OFFData:
         return verts, faces
 
     def _make_bbox(self):
-        box = BoundingBox()
-        box.include_points(self.points)
-        return box
+        coords = self._arrays[0]
+        if not coords:
+            return BoundingBox()
+        return BoundingBox([min(coords[axis::3]) for axis in range(3)],
+                           [max(coords[axis::3]) for axis in range(3)])
 
     def _compute_face_normal(self, f):
         a, b, c = [self.points[i] for i in f[:3]]
@@ -152,27 +482,86 @@ class OFFData:
         norm.normalize()
         return norm
 
-    def _compute_vertex_normal(self, vert_i):
-        n = Vector([0, 0, 0])
-        for face_i, face in enumerate(self.faces):
-            if vert_i in face:
-                n += self._f_norms[face_i]
-        try:
-            n.normalize()
-        except ZeroDivisionError:
-            pass
-        return n
+    def _compute_vertex_normals(self, weighting=None):
+        # accumulate each face's normal into its vertices in one pass
+        if weighting not in (None, "area", "angle"):
+            raise ValueError("Unknown normal weighting: {}".format(weighting))
+        sums = [[0.0, 0.0, 0.0] for p in self.points]
+        for face, fnorm in zip(self.faces, self._f_norms):
+            if weighting == "area":
+                weights = [self._face_area(face)] * len(face)
+            elif weighting == "angle":
+                weights = self._face_angles(face)
+            else:
+                weights = [1.0] * len(face)
+            seen = set()
+            for vert_i, w in zip(face, weights):
+                if vert_i in seen:
+                    continue
+                seen.add(vert_i)
+                total = sums[vert_i]
+                for axis in range(3):
+                    total[axis] += w * fnorm[axis]
+
+        normals = []
+        for total in sums:
+            n = Vector(total)
+            try:
+                n.normalize()
+            except ZeroDivisionError:
+                pass
+            normals.append(n)
+        return normals
+
+    def _face_area(self, face):
+        # area of (planar) polygon face as a fan of triangles
+        pts = [self.points[i] for i in face]
+        total = Vector([0, 0, 0])
+        for i in range(1, len(pts)-1):
+            total += (pts[i]-pts[0]).cross(pts[i+1]-pts[0])
+        return total.mag() / 2
+
+    def _face_angles(self, face):
+        # interior angle of polygon face at each of its vertices
+        pts = [self.points[i] for i in face]
+        angles = []
+        for i, p in enumerate(pts):
+            v1 = pts[i-1] - p
+            v2 = pts[(i+1) % len(pts)] - p
+            try:
+                cosine = v1.dot(v2) / (v1.mag() * v2.mag())
+            except ZeroDivisionError:
+                angles.append(0.0)
+                continue
+            angles.append(acos(max(-1.0, min(1.0, cosine))))
+        return angles
+
+    @property
+    def face_normals(self):
+        if self._f_norms is None:
+            self._f_norms = _vectors(self._arrays[3])
+        return self._f_norms
+
+    @property
+    def vertex_normals(self):
+        if self._v_norms is None:
+            self._v_norms = _vectors(self._arrays[4])
+        return self._v_norms
 
     def get_points(self, face):
         return [self.points[i] for i in self.faces[face]]
 
     def get_face_normal(self, face):
-        return self._f_norms[face]
+        return self.face_normals[face]
 
     def get_vertex_normals(self, face):
-        return [self._v_norms[i] for i in self.faces[face]]
+        return [self.vertex_normals[i] for i in self.faces[face]]
 
     def recenter(self):
-        dist = Vector(self.bbox.midpoint)
-        self.points = [vert-dist for vert in self.points]
+        dist = self.bbox.midpoint
+        coords = array("d", self._arrays[0])
+        for i in range(len(coords)):
+            coords[i] -= dist[i % 3]
+        self._arrays = [coords] + self._arrays[1:]
+        self._points = None
         self.bbox = self._make_bbox()
@@ -0,0 +1,119 @@
+# meshcache.py
+#    Binary cache of data computed from mesh files, so that repeat loads
+#    of a scene can skip parsing and preprocessing.
+#
+# Each cache file holds a list of arrays computed from one source file.
+# The header records the source's size, mtime and SHA-1 hash; a cache
+# file is used if the size and mtime still match, or failing that if the
+# contents still hash the same (and then the new mtime is recorded). A
+# file whose arrays do not exactly fill it is ignored.
+
+import array
+import hashlib
+import mmap
+import os
+import struct
+
+CACHE_DIR = "meshcache"
+
+_MAGIC = b"R3DC"
+_VERSION = 2     # 2: FlatBVH children stored lower child first
+_HEADER = struct.Struct("<4sIqq20sI")
+_ARRAY_HEADER = struct.Struct("<cQ")
+_MTIME_OFFSET = struct.calcsize("<4sI")
+
+
+def cache_path(source, entry):
+    """ path of the cache file for entry computed from source """
+    return os.path.join(CACHE_DIR,
+                        "{}.{}.bin".format(os.path.basename(source), entry))
+
+
+def _digest(source):
+    with open(source, "rb") as infile:
+        return hashlib.sha1(infile.read()).digest()
+
+
+def load(source, entry):
+    """ return the list of arrays cached for entry of source, or None
+    if there is no up to date cache file.
+    """
+    path = cache_path(source, entry)
+    try:
+        stat = os.stat(source)
+        with open(path, "rb") as infile:
+            data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    with data:
+        if len(data) < _HEADER.size:
+            return None
+        magic, version, mtime, size, digest, narrays = \
+            _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != _VERSION or size != stat.st_size:
+            return None
+        stale = mtime != stat.st_mtime_ns
+        if stale and digest != _digest(source):
+            return None
+        try:
+            arrays = _read_arrays(data, narrays)
+        except (struct.error, ValueError):
+            return None
+    if arrays is not None and stale:
+        _set_mtime(path, stat.st_mtime_ns)
+    return arrays
+
+
+def _read_arrays(data, narrays):
+    # the narrays arrays following the header in data, or None if they
+    # do not exactly fill it
+    arrays = []
+    offset = _HEADER.size
+    for i in range(narrays):
+        if offset + _ARRAY_HEADER.size > len(data):
+            return None
+        typecode, count = _ARRAY_HEADER.unpack_from(data, offset)
+        offset += _ARRAY_HEADER.size
+        arr = array.array(typecode.decode())
+        nbytes = count * arr.itemsize
+        if offset + nbytes > len(data):
+            return None
+        arr.frombytes(data[offset:offset+nbytes])
+        offset += nbytes
+        arrays.append(arr)
+    if offset != len(data):
+        return None
+    return arrays
+
+
+def _set_mtime(path, mtime):
+    # record a new mtime for a source whose contents are unchanged, so
+    # later loads need not hash it again
+    try:
+        with open(path, "r+b") as outfile:
+            outfile.seek(_MTIME_OFFSET)
+            outfile.write(struct.pack("<q", mtime))
+    except OSError:
+        pass
+
+
+def save(source, entry, arrays):
+    """ write arrays to the cache file for entry of source. Failure to
+    write the cache is not an error; the data just is not cached.
+    """
+    path = cache_path(source, entry)
+    try:
+        stat = os.stat(source)
+        header = _HEADER.pack(_MAGIC, _VERSION, stat.st_mtime_ns,
+                              stat.st_size, _digest(source), len(arrays))
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmppath = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmppath, "wb") as outfile:
+            outfile.write(header)
+            for arr in arrays:
+                outfile.write(_ARRAY_HEADER.pack(arr.typecode.encode(),
+                                                 len(arr)))
+                arr.tofile(outfile)
+        os.replace(tmppath, path)
+    except OSError:
+        pass
@@ -5,7 +5,7 @@
 from math import sin, cos, pi, sqrt, tau
 from ren3d.math3d import Point, Vector
 from ren3d.materials import make_material
-import ren3d.matrix as mat
+from ren3d.bbox import BoundingBox
 import ren3d.trans3d as trans3d
 
 
@@ -19,6 +19,7 @@ class Box:
         self.planes = planes
         self.color = make_material(color)
         self.texture = texture
+        self.bbox = BoundingBox(*zip(*planes))
 
     def iter_polygons(self):
         ijseq = [(0, 0), (1, 0), (1, 1), (0, 1)]
@@ -52,7 +53,6 @@ class Box:
                     hit = True
                     interval.high = t
                     info.t = t
-                    info.object = self
                     info.point = p
                     info.normal = Vector([0]*3)
                     info.normal[axis] = (-1.0, 1.0)[lh]
@@ -62,6 +62,19 @@ class Box:
                         info.textcoords = self.generic_coords(p)
         return hit
 
+    def occluded(self, ray, interval):
+        """ True iff ray hits the box within interval """
+        s, d = ray.start, ray.dir
+        planes = self.planes
+        for axis in range(3):
+            if d[axis] == 0.0:
+                continue
+            for lh in range(2):
+                t = (planes[axis][lh] - s[axis])/d[axis]
+                if t in interval and self._inrect(ray.point_at(t), axis):
+                    return True
+        return False
+
     def generic_coords(self, p):
         uvn = [2*(p[a]-self.planes[a][0])/(self.planes[a][1]-self.planes[a][0]) - 1
                for a in [0, 1, 2]]
@@ -95,7 +108,8 @@ class Sphere:
         self.northpole = self.pos + axis
         self.southpole = self.pos - axis
         self.texture = texture
-        cx, cy, cz = pos
+        self.bbox = BoundingBox(self.pos - Vector((radius,)*3),
+                                self.pos + Vector((radius,)*3))
 
     def _make_bands(self, nlat, nlong):
         # helper method that creates a list of "bands" where each band consists
@@ -189,6 +203,23 @@ class Sphere:
                 return True
         return False
 
+    def occluded(self, ray, interval):
+        """ True iff ray hits the sphere within interval """
+        dir = ray.dir
+        r = self.radius
+        s_p = ray.start-self.pos
+
+        a = dir.mag2()
+        b = 2 * dir.dot(s_p)
+        c = s_p.mag2() - r*r
+        discrim = b*b - 4 * a * c
+        if discrim <= 0:
+            return False
+
+        discrt = sqrt(discrim)
+        return ((-b - discrt)/(2*a) in interval
+                or (-b + discrt)/(2*a) in interval)
+
     def _setinfo(self, ray, t, info):
         # helper method to fill in the info record
         p = ray.point_at(t)
@@ -203,16 +234,23 @@ class Sphere:
 
 class Transformable:
 
-    def __init__(self, surface):
+    def __init__(self, surface, trans=None):
+        """ surface placed by trans, a trans3d.Affine (identity if None)
+        that is further modified by the scale, translate and rotate
+        methods """
         self.surface = surface
-        self.trans = mat.unit(4)
-        self.itrans = mat.unit(4)
-        self.ntrans = mat.unit(4)
+        if trans is None:
+            trans = trans3d.Affine(None, trans3d.Affine())
+        self._set_trans(trans)
+
+    def _set_trans(self, trans):
+        # trans, itrans and ntrans are trans3d.Affine transforms
+        self.trans = trans
+        self.itrans = trans.inverse()
+        self.ntrans = trans.normal()
 
     def _update(self, trans, itrans):
-        self.trans = mat.mul(trans, self.trans)
-        self.itrans = mat.mul(self.itrans, itrans)
-        self.ntrans = mat.transpose(self.itrans)
+        self._set_trans(trans3d.Affine(trans, itrans).compose(self.trans))
 
     def scale(self, sx, sy, sz):
         trans = trans3d.scale(sx, sy, sz)
@@ -246,21 +284,72 @@ class Transformable:
 
     def iter_polygons(self):
         for poly in self.surface.iter_polygons():
-            transpoints = [p.transform(self.trans) for p in poly.points]
+            transpoints = [self.trans.apply_point(p) for p in poly.points]
             poly.points = transpoints
-            normals = [n.transform(self.ntrans) for n in poly.normals]
+            normals = [self.ntrans.apply_vector(n) for n in poly.normals]
             poly.normals = normals
             yield poly
 
+    @property
+    def bbox(self):
+        return self.surface.bbox.transform(self.trans)
+
     def intersect(self, ray, interval, info):
-        iray = ray.transform(self.itrans)
+        iray = self.itrans.apply_ray(ray)
         hit = self.surface.intersect(iray, interval, info)
         if hit:
-            info.point = info.point.transform(self.trans)
-            info.normal = info.normal.transform(self.ntrans)
+            info.point = self.trans.apply_point(info.point)
+            info.normal = self.ntrans.apply_vector(info.normal)
             info.normal.normalize()
         return hit
 
+    def occluded(self, ray, interval):
+        return self.surface.occluded(self.itrans.apply_ray(ray), interval)
+
+
+class Animated(Transformable):
+    """A Transformable whose placement changes from frame to frame.
+    pose(t, frame) applies the transforms for frame to t, a fresh
+    Transformable (e.g. lambda t, f: t.rotate_y(30*f)). Transforms
+    applied with the scale, translate and rotate methods come after the
+    pose, whatever the frame.
+
+    >>> a = Animated(Sphere(), lambda t, f: t.translate(f, 0, 0))
+    >>> a.translate(0, 1, 0).trans.apply_point(Point([0, 0, 0]))
+    Point([0.0, 1.0, 0.0])
+    >>> a.set_frame(2)
+    >>> a.trans.apply_point(Point([0, 0, 0]))
+    Point([2.0, 1.0, 0.0])
+    """
+
+    def __init__(self, surface, pose, frame=0):
+        self.pose = pose
+        self.after = trans3d.Affine(None, trans3d.Affine())
+        Transformable.__init__(self, surface)
+        self.set_frame(frame)
+
+    def _update(self, trans, itrans):
+        self.after = trans3d.Affine(trans, itrans).compose(self.after)
+        Transformable._update(self, trans, itrans)
+
+    def set_frame(self, frame):
+        t = Transformable(None)
+        self.pose(t, frame)
+        self.frame = frame
+        self._set_trans(self.after.compose(t.trans))
+
+
+def iter_animated(surface):
+    """ yield the Animated surfaces in surface (which may be nested in
+    Groups and Transformables) """
+    if isinstance(surface, Group):
+        for obj in surface.objects:
+            yield from iter_animated(obj)
+    elif isinstance(surface, Transformable):
+        if isinstance(surface, Animated):
+            yield surface
+        yield from iter_animated(surface.surface)
+
 
 class Square:
 
@@ -270,6 +359,7 @@ class Square:
                        Point([.5, 0., .5]), Point([.5, 0., -.5])]
         self.normal = Vector([0., 1., 0.])
         self.texture = texture
+        self.bbox = BoundingBox((-.5, 0., -.5), (.5, 0., .5))
 
     def iter_polygons(self):
         r = Record()
@@ -296,6 +386,17 @@ class Square:
             info.textcoords = (2*p.x, 0, 2*p.z)
         return hit
 
+    def occluded(self, ray, interval):
+        dy = ray.dir.y
+        if dy == 0.:
+            return False
+        t = -ray.start.y/dy
+        if t not in interval:
+            return False
+        x = ray.start.x + t*ray.dir.x
+        z = ray.start.z + t*ray.dir.z
+        return (-.5 <= x <= .5) and (-.5 <= z <= .5)
+
 
 class Cylinder:
 
@@ -309,6 +410,9 @@ class Cylinder:
         self.nlong = nlong
         self.texture = texture
         self.yrange = self.pos[1], self.pos[1] + height
+        cx, cy, cz = self.pos
+        self.bbox = BoundingBox((cx-radius, cy, cz-radius),
+                                (cx+radius, cy+height, cz+radius))
         #self._make_bands()
 
     """def _make_bands(self):
@@ -410,6 +514,9 @@ class Cylinder:
         if self.texture:
             info.textcoords = self.generic_coords(p)
 
+    def occluded(self, ray, interval):
+        return self.intersect(ray, interval, HitRecord())
+
     def normal_at(self, pt):
         return Vector((2*pt[0], 0, 2*pt[2]))
 
@@ -433,6 +540,13 @@ class Group:
             for poly in obj.iter_polygons():
                 yield poly
 
+    @property
+    def bbox(self):
+        box = BoundingBox()
+        for obj in self.objects:
+            box.include_box(obj.bbox)
+        return box
+
     def intersect(self, ray, interval, info):
         """Returns True iff ray intersects some object in the group
 
@@ -446,6 +560,58 @@ class Group:
                 hit = True
         return hit
 
+    def occluded(self, ray, interval):
+        """Returns True iff ray hits any object in the group within
+        interval. No hit information is computed.
+        """
+        for obj in self.objects:
+            if obj.occluded(ray, interval):
+                return True
+        return False
+
+    def occluder(self, ray, interval):
+        """Returns the first object in the group that ray hits within
+        interval, or None"""
+        for obj in self.objects:
+            if obj.occluded(ray, interval):
+                return obj
+        return None
+
+
+def flatten(surface, trans=None, meshes=False):
+    """ yield the primitive surfaces that make up surface, each in world
+    space.
+
+    Groups are dissolved and nested Transformables are composed, so each
+    primitive that is transformed at all is wrapped in one Transformable
+    holding its world transform (trans is the transform that applies to
+    surface itself). Identity transforms are dropped. When meshes is
+    True, a transformed surface with a transformed method (a Mesh) is
+    replaced by a copy already moved into world space.
+
+    >>> s = Sphere()
+    >>> g = Group()
+    >>> g.add(Transformable(s).translate(1, 0, 0))
+    >>> t = Transformable(g).translate(-1, 0, 0)
+    >>> list(flatten(t)) == [s]
+    True
+    """
+    if isinstance(surface, Group):
+        for obj in surface.objects:
+            yield from flatten(obj, trans, meshes)
+    elif isinstance(surface, Transformable):
+        if trans is not None:
+            trans = trans.compose(surface.trans)
+        else:
+            trans = surface.trans
+        yield from flatten(surface.surface, trans, meshes)
+    elif trans is None or trans.is_identity():
+        yield surface
+    elif meshes and hasattr(surface, "transformed"):
+        yield surface.transformed(trans)
+    else:
+        yield Transformable(surface, trans)
+
 
 # ----------------------------------------------------------------------
 class Record:
@@ -482,6 +648,30 @@ class Record:
         return "Record({})".format(", ".join(fields))
 
 
+class HitRecord:
+    """ the information about a ray hit that intersect methods fill in.
+    The fields are fixed, so records are small and can be reused.
+
+    >>> hit = HitRecord()
+    >>> hit.t = 2.5
+    >>> hit.point = Point([1,2,3])
+    >>> hit
+    HitRecord(t=2.5, point=Point([1.0, 2.0, 3.0]))
+    """
+
+    __slots__ = ("t", "point", "normal", "color", "texture", "textcoords")
+
+    def __init__(self):
+        self.t = self.point = self.normal = self.color = None
+        self.texture = self.textcoords = None
+
+    def __repr__(self):
+        fields = ["{}={}".format(name, getattr(self, name))
+                  for name in self.__slots__
+                  if getattr(self, name) is not None]
+        return "HitRecord({})".format(", ".join(fields))
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -46,11 +46,18 @@ class Ray:
         >>> r.point_at(3.75)
         Point([3.75, 8.5, 13.25])
         """
-        return self.start + t*self.dir
+        return self.start.madd(t, self.dir)
 
     def transform(self, trans):
-        return Ray(self.start.transform(trans),
-                   self.dir.transform(trans))
+        return _ray(self.start.transform(trans), self.dir.transform(trans))
+
+
+def _ray(start, dir):
+    # fast construction from a Point and Vector that are not copied
+    r = object.__new__(Ray)
+    r.start = start
+    r.dir = dir
+    return r
 
 # ----------------------------------------------------------------------
 
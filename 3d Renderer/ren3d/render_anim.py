@@ -0,0 +1,365 @@
+# render_anim.py
+#    Rendering successive frames of an animated scene
+#
+# Consecutive frames of an animation usually differ in a few objects. A
+# FrameTracer keeps, for every pixel, the segments of all the rays that
+# were traced for it (the primary ray up to its hit, shadow rays and
+# reflections). When a frame moves some objects, a pixel can only change
+# if one of its segments passes through the bounding box of a changed
+# object, before or after the move; just those pixels are traced again
+# and the rest of the image is kept from the previous frame.
+
+from array import array
+from math import inf
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import os
+
+from ren3d.models import Transformable, Record, flatten
+from ren3d.ray3d import Interval
+from ren3d.image import Image
+from ren3d.render_ray import raycolor, raytrace_tile, make_tiles, order_tiles
+from ren3d.render_ray import TILE_SIZE
+
+# each logged segment is ray start (3), ray direction (3) and t range (2)
+_SEGMENT = 8
+
+
+class _Blocker:
+    # a shadow occluder handed out by _RayLog: logs the shadow rays it
+    # blocks (render_ray caches occluders and asks them directly)
+
+    def __init__(self, log, surface):
+        self.log = log
+        self.surface = surface
+
+    def occluded(self, ray, interval):
+        if self.surface.occluded(ray, interval):
+            self.log.record(ray, interval.low, interval.high)
+            return True
+        return False
+
+
+class _RayLog:
+    # stands in for the scene's surface while a frame is traced: passes
+    # every query on and records the segment of the ray that was searched
+
+    def __init__(self, surface):
+        self.surface = surface
+        self.segments = array("d")
+        self._blockers = {}
+
+    def record(self, ray, low, high):
+        s, d = ray.start, ray.dir
+        self.segments.extend((s.x, s.y, s.z, d.x, d.y, d.z, low, high))
+
+    def intersect(self, ray, interval, info):
+        low = interval.low
+        hit = self.surface.intersect(ray, interval, info)
+        self.record(ray, low, interval.high)
+        return hit
+
+    def occluded(self, ray, interval):
+        self.record(ray, interval.low, interval.high)
+        return self.surface.occluded(ray, interval)
+
+    def occluder(self, ray, interval):
+        self.record(ray, interval.low, interval.high)
+        blocker = self.surface.occluder(ray, interval)
+        if blocker is None:
+            return None
+        if id(blocker) not in self._blockers:
+            self._blockers[id(blocker)] = _Blocker(self, blocker)
+        return self._blockers[id(blocker)]
+
+
+class _Recording:
+    # the scene as raycolor sees it while a frame is recorded: the same
+    # scene with its surface wrapped in a _RayLog (and so with its own
+    # shadow occluders, which log the rays they block)
+
+    def __init__(self, scene, log):
+        self._scene = scene
+        self.surface = log
+        self.occluders = {}
+
+    def __getattr__(self, name):
+        return getattr(self._scene, name)
+
+
+def object_boxes(scene):
+    """ return a dict giving the world bounding box (low, high) and
+    transform of each primitive in scene. Keys are (id(primitive),
+    n), the nth placement of that primitive. """
+    boxes = {}
+    for prim in flatten(scene.objects):
+        if isinstance(prim, Transformable):
+            surface, trans = prim.surface, prim.trans.m
+        else:
+            surface, trans = prim, None
+        n = 0
+        while (id(surface), n) in boxes:
+            n += 1
+        low, high = prim.bbox.bounds
+        boxes[id(surface), n] = (tuple(low), tuple(high)), trans
+    return boxes
+
+
+def _view(scene):
+    # everything other than the objects that the colors of pixels depend on
+    cam = scene.camera
+    return (tuple(cam.eye), tuple(cam.u), tuple(cam.v), tuple(cam.n),
+            cam.window, cam.distance,
+            [(tuple(p), tuple(c)) for p, c in scene.lights],
+            tuple(scene.ambient), tuple(scene.background), scene.shadows,
+            scene.reflections, scene.textures)
+
+
+def changed_boxes(old, new):
+    """ return the bounding boxes of the objects that moved, appeared or
+    disappeared between two object_boxes dicts (both boxes for those
+    that moved)
+
+    >>> a = {(1, 0): (((0, 0, 0), (1, 1, 1)), None)}
+    >>> b = {(1, 0): (((1, 0, 0), (2, 1, 1)), (1,)*12)}
+    >>> changed_boxes(a, a)
+    []
+    >>> changed_boxes(a, b)
+    [((0, 0, 0), (1, 1, 1)), ((1, 0, 0), (2, 1, 1))]
+    >>> changed_boxes(a, {})
+    [((0, 0, 0), (1, 1, 1))]
+    """
+    boxes = []
+    for key in old.keys() | new.keys():
+        if key not in new:
+            boxes.append(old[key][0])
+        elif key not in old:
+            boxes.append(new[key][0])
+        elif old[key] != new[key]:
+            boxes.append(old[key][0])
+            boxes.append(new[key][0])
+    return boxes
+
+
+def _crosses(segments, start, stop, boxes):
+    # True iff one of the segments in segments[start:stop] passes
+    # through one of boxes
+    for k in range(start, stop, _SEGMENT):
+        sx, sy, sz, dx, dy, dz, t0, t1 = segments[k:k+_SEGMENT]
+        for low, high in boxes:
+            lo, hi = t0, t1
+            for s, d, bmin, bmax in ((sx, dx, low[0], high[0]),
+                                     (sy, dy, low[1], high[1]),
+                                     (sz, dz, low[2], high[2])):
+                if d == 0:
+                    if s < bmin or s > bmax:
+                        break
+                    continue
+                ta, tb = (bmin-s)/d, (bmax-s)/d
+                if ta > tb:
+                    ta, tb = tb, ta
+                if ta > lo:
+                    lo = ta
+                if tb < hi:
+                    hi = tb
+                if lo > hi:
+                    break
+            else:
+                return True
+    return False
+
+
+def _padded(box):
+    # box grown a little, so rays that graze it are caught
+    low, high = box
+    pad = 1e-6 * max([1.0] + [abs(v) for v in low + high if abs(v) < inf])
+    return (tuple(v-pad for v in low), tuple(v+pad for v in high))
+
+
+class FrameTracer:
+    """Ray traces successive frames of an animated scene of the given
+    size into one image, retracing only the pixels that can have changed
+    since the previous frame.
+
+    Changes are found by comparing the world transforms of the primitives
+    in the scene, so animate objects by changing Transformables (or by
+    adding or removing objects). Any change to the camera, lights or
+    scene settings retraces the whole frame. Changes to materials or
+    textures are not noticed.
+    """
+
+    def __init__(self, scene, size):
+        self.scene = scene
+        self.image = Image(size)
+        self._boxes = None
+        self._view = None
+        self._segments = array("d")
+        self._starts = array("L", [0]) * (size[0]*size[1] + 1)
+
+    def render(self, updatefn=None):
+        """ trace the current state of the scene into self.image and
+        return a Record of the number of pixels and of pixels traced.
+        updatefn is called after each row with retraced pixels. """
+        scene = self.scene
+        w, h = self.image.size
+        scene.update_transforms()
+        boxes, view = object_boxes(scene), _view(scene)
+        if self._boxes is None or view != self._view:
+            dirty = range(w*h)
+        else:
+            changed = [_padded(b) for b in changed_boxes(self._boxes, boxes)]
+            dirty = self._dirty(changed) if changed else []
+        self._boxes, self._view = boxes, view
+        if dirty:
+            self._retrace(dirty, updatefn)
+        return Record(pixels=w*h, traced=len(dirty))
+
+    def _dirty(self, boxes):
+        # the pixels that have a segment passing through one of boxes
+        segments, starts = self._segments, self._starts
+        return [k for k in range(len(starts)-1)
+                if _crosses(segments, starts[k], starts[k+1], boxes)]
+
+    def _retrace(self, pixels, updatefn):
+        # trace pixels (in increasing order) and splice their new segments
+        # into the log
+        scene = self.scene
+        img = self.image
+        w, h = img.size
+        camera = scene.camera
+        camera.set_resolution(w, h)
+        log = _RayLog(scene.surface)
+        recording = _Recording(scene, log)
+        old, oldstarts = self._segments, self._starts
+        segments = array("d")
+        starts = array("L", [0]) * len(oldstarts)
+        last = 0
+        row = None
+        hits = []
+        for k in pixels:
+            # copy the kept segments of the pixels before this one
+            segments.extend(old[oldstarts[last]:oldstarts[k]])
+            for m in range(last+1, k+1):
+                starts[m] = starts[m-1] + oldstarts[m] - oldstarts[m-1]
+            i, j = k % w, k // w
+            if updatefn and row is not None and j != row:
+                updatefn()
+            row = j
+            ray = next(camera.row_rays(j, i, i+1))
+            log.segments = segments
+            color = raycolor(recording, ray, Interval(), scene.reflections,
+                             hits)
+            img[i, j] = color.quantize(255)
+            starts[k+1] = len(segments)
+            last = k+1
+        segments.extend(old[oldstarts[last]:])
+        for m in range(last+1, len(starts)):
+            starts[m] = starts[m-1] + oldstarts[m] - oldstarts[m-1]
+        self._segments, self._starts = segments, starts
+        if updatefn:
+            updatefn()
+
+
+def raytrace_frames(scene, size, updates, updatefn=None):
+    """ render an animation of scene: for each update in updates, call
+    update(scene) to pose the scene for the next frame, then render the
+    frame with a FrameTracer. Yields (image, stats) per frame, where
+    image is the same Image each time, changed in place, and stats is
+    the Record returned by FrameTracer.render.
+    """
+    tracer = FrameTracer(scene, size)
+    for update in updates:
+        update(scene)
+        yield tracer.image, tracer.render(updatefn)
+
+
+def raytrace_animation(scene, size, frames=None, updatefn=None):
+    """ render frames (default: all scene.frames of them) of an animated
+    scene, posing it with scene.set_frame. Yields (frame, image, stats)
+    as raytrace_frames does. The scene is loaded and compiled once;
+    between frames only the Animated objects are moved. """
+    if frames is None:
+        frames = range(scene.frames)
+    tracer = FrameTracer(scene, size)
+    for frame in frames:
+        scene.set_frame(frame)
+        yield frame, tracer.image, tracer.render(updatefn)
+
+
+# ----------------------------------------------------------------------
+# Parallel animation rendering
+#   The tiles of all the frames form one queue, so workers go straight on
+#   to the next frame while the last tiles of a frame are finished.
+
+# scene of each worker process, and the frame it is posed for
+_worker_scene = None
+_worker_frame = None
+
+
+def _init_worker(scenename, size):
+    global _worker_scene, _worker_frame
+    from ren3d.scenedef import load_scene
+    _worker_scene, modname = load_scene(scenename)
+    _worker_scene.camera.set_resolution(*size)
+    _worker_frame = None
+
+
+def _worker_tile(n, frame, tile):
+    # trace tile of frame, the nth frame rendered
+    global _worker_frame
+    if frame != _worker_frame:
+        _worker_scene.set_frame(frame)
+        _worker_frame = frame
+    return n, tile, raytrace_tile(_worker_scene, tile)
+
+
+def raytrace_animation_parallel(scenename, size, frames=None, nworkers=None,
+                                updatefn=None, tilesize=TILE_SIZE,
+                                order="cost", lookahead=2):
+    """ render frames (default: all) of the animated scene defined in
+    module scenename with a pool of nworkers processes (default: one per
+    core), each of which loads the scene once. Yields (frame, image) for
+    each frame in order as soon as it is complete. Tiles are queued frame
+    after frame (within a frame in the given order, see
+    render_ray.order_tiles), and tiles of up to lookahead frames are
+    in progress at once, so only that many images are held. updatefn is
+    called as each tile is finished.
+    """
+    from ren3d.scenedef import load_scene
+    scene, modname = load_scene(scenename)
+    frames = list(range(scene.frames) if frames is None else frames)
+    tiles = make_tiles(size, tilesize)
+    if order == "cost":
+        scene.camera.set_resolution(*size)
+        if frames:
+            scene.set_frame(frames[0])
+    tiles = order_tiles(scene, tiles, order)
+    nworkers = nworkers or os.cpu_count()
+
+    jobs = [(n, tile) for n in range(len(frames)) for tile in tiles]
+    images = {}             # frame index: [image, tiles left]
+    emitted = 0             # frames yielded so far
+    submitted = 0
+    pending = set()
+    with ProcessPoolExecutor(nworkers, initializer=_init_worker,
+                             initargs=(scenename, size)) as pool:
+        while True:
+            # keep the workers supplied, within lookahead frames
+            while (submitted < len(jobs) and len(pending) < 2*nworkers
+                   and jobs[submitted][0] < emitted + lookahead):
+                n, tile = jobs[submitted]
+                if n not in images:
+                    images[n] = [Image(size), len(tiles)]
+                pending.add(pool.submit(_worker_tile, n, frames[n], tile))
+                submitted += 1
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for job in done:
+                n, tile, pixels = job.result()
+                images[n][0].set_tile(tile, pixels)
+                images[n][1] -= 1
+                if updatefn:
+                    updatefn()
+            while emitted in images and not images[emitted][1]:
+                yield frames[emitted], images.pop(emitted)[0]
+                emitted += 1
@@ -0,0 +1,195 @@
+# render_deferred.py
+#    Deferred shading: visibility first, then shading over whole buffers
+#
+# The first pass traces the primary ray of every pixel and records what
+# it hit in a GBuffer. The second pass shades the whole buffer one light
+# at a time with array operations (shade_buffers), using a shadow mask
+# per light traced as one packet (render_packet), so each light costs
+# one pass over the buffers rather than a Python loop per pixel.
+# Scenes the packet tracer does not support get their shadow masks from
+# the scalar any-hit query. Reflections are traced per pixel by raycolor
+# and added at the end. Shading needs NumPy; without it the scene is
+# traced by render_ray.raytrace.
+
+from array import array
+from math import inf
+
+from ren3d.models import HitRecord
+from ren3d.ray3d import Ray, Interval
+from ren3d.math3d import Point, Vector
+from ren3d.render_ray import raytrace, raycolor, EPSILON
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class GBuffer:
+    """Per-pixel results of the visibility pass for an image of size
+    (w, h). Each buffer is a flat array with one entry per pixel (three
+    for points, vectors and colors), in rows from the bottom:
+      hit: 1 where the primary ray hit a surface
+      point, normal, dir: the hit point, unit normal and ray direction
+      ambient, diffuse: the material colors, or the texture color where
+          the surface is textured
+      material: index of the material in materials
+    """
+
+    def __init__(self, size):
+        w, h = size
+        n = w * h
+        self.size = size
+        self.hit = array("B", bytes(n))
+        self.point = array("d", bytes(24*n))
+        self.normal = array("d", bytes(24*n))
+        self.dir = array("d", bytes(24*n))
+        self.ambient = array("d", bytes(24*n))
+        self.diffuse = array("d", bytes(24*n))
+        self.material = array("i", bytes(4*n))
+        self.materials = []
+        self._index = {}
+
+    def _material(self, mat):
+        if id(mat) not in self._index:
+            self._index[id(mat)] = len(self.materials)
+            self.materials.append(mat)
+        return self._index[id(mat)]
+
+    def fill(self, scene):
+        """ trace the primary rays of scene into the buffers """
+        camera = scene.camera
+        w, h = self.size
+        camera.set_resolution(w, h)
+        surface = scene.surface
+        hit = HitRecord()
+        for i, j, ray in camera.tile_rays((0, 0, w, h)):
+            if not surface.intersect(ray, Interval(), hit):
+                continue
+            k = j*w + i
+            self.hit[k] = 1
+            mat = hit.color
+            if scene.textures and hit.texture:
+                ambient = diffuse = hit.texture(hit.textcoords)
+            else:
+                ambient, diffuse = mat.ambient, mat.diffuse
+            self.material[k] = self._material(mat)
+            self.point[3*k:3*k+3] = array("d", hit.point)
+            self.normal[3*k:3*k+3] = array("d", hit.normal)
+            self.dir[3*k:3*k+3] = array("d", ray.dir)
+            self.ambient[3*k:3*k+3] = array("d", ambient)
+            self.diffuse[3*k:3*k+3] = array("d", diffuse)
+
+
+def shade_buffers(scene, point, normal, dirs, ambient, diffuse, specular,
+                  shininess, occluded):
+    """ Blinn-Phong shading (as in render_ray.raycolor, but without
+    reflection) of n hits given as NumPy arrays: n x 3 arrays of hit
+    points, unit normals, ray directions and ambient, diffuse and
+    specular colors, and n shininess exponents. occluded(points, lvecs)
+    returns a boolean array that is True where the shadow ray from a
+    point along lvec (to the light) is blocked. Returns the n x 3 array
+    of colors.
+    """
+    color = ambient * np.array(tuple(scene.ambient))
+    vvec = -(dirs * (1/_mag(dirs))[:, None])
+    for lpos, lcolor in scene.lights:
+        lpos, lcolor = np.array(tuple(lpos)), np.array(tuple(lcolor))
+        lvec = lpos - point
+        if scene.shadows:
+            lit = ~occluded(point, lvec)[:, None]
+        else:
+            lit = np.ones((len(point), 1), dtype=bool)
+        lvec = lvec / _mag(lvec)[:, None]
+        ldot = np.maximum(0.0, _dot(lvec, normal))
+        color = np.where(lit, color + (diffuse * ldot[:, None]) * lcolor,
+                         color)
+        hvec = vvec + lvec
+        hvec = hvec / _mag(hvec)[:, None]
+        spec = np.maximum(0.0, _dot(hvec, normal)) ** shininess
+        color = np.where(lit, color + (spec[:, None] * lcolor) * specular,
+                         color)
+    return color
+
+
+def _dot(a, b):
+    return a[:, 0]*b[:, 0] + a[:, 1]*b[:, 1] + a[:, 2]*b[:, 2]
+
+
+def _mag(a):
+    return np.sqrt(_dot(a, a))
+
+
+def shade_gbuffer(scene, gbuf):
+    """ return the colors of the pixels in gbuf as a (w*h) x 3 NumPy
+    array (background where nothing was hit) """
+    w, h = gbuf.size
+    colors = np.empty((w*h, 3))
+    colors[:] = tuple(scene.background)
+    hits = np.flatnonzero(np.frombuffer(gbuf.hit, dtype=np.uint8))
+    if not len(hits):
+        return colors
+
+    def buffer(name):
+        return np.frombuffer(getattr(gbuf, name)).reshape(-1, 3)[hits]
+
+    point, normal, dirs = buffer("point"), buffer("normal"), buffer("dir")
+    mats = gbuf.materials
+    mat = np.frombuffer(gbuf.material, dtype=np.int32)[hits]
+    specular = np.array([tuple(m.specular) for m in mats])[mat]
+    shininess = np.array([float(m.shininess) for m in mats])[mat]
+
+    # shadow masks come from the packet tracer's vectorized any-hit
+    # query when it supports the scene, otherwise from the scalar one
+    # (imported here, since render_packet imports this module)
+    from ren3d.render_packet import PacketTracer, packet_support
+    if scene.shadows and packet_support(scene) is None:
+        tracer = PacketTracer(scene)
+
+        def occluded(points, lvecs):
+            return tracer.occluded(points, lvecs, EPSILON, 1)
+    else:
+        surface = scene.surface
+
+        def occluded(points, lvecs):
+            return np.array([surface.occluded(Ray(Point(p), Vector(l)),
+                                              Interval(EPSILON, 1))
+                             for p, l in zip(points.tolist(),
+                                             lvecs.tolist())],
+                            dtype=bool)
+
+    color = shade_buffers(scene, point, normal, dirs, buffer("ambient"),
+                          buffer("diffuse"), specular, shininess, occluded)
+
+    # reflections, traced per pixel
+    if scene.reflections > 0:
+        records = []
+        for k in np.flatnonzero([bool(mats[m].reflect) for m in mat]):
+            reflect = mats[mat[k]].reflect
+            refldir = Vector(dirs[k]).reflection(Vector(normal[k]))
+            reflray = Ray(Point(point[k]), refldir)
+            rcolor = raycolor(scene, reflray, Interval(EPSILON, inf),
+                              scene.reflections-1, records) * reflect
+            color[k] = color[k] + np.array(tuple(rcolor))
+    colors[hits] = color
+    return colors
+
+
+def raytrace_deferred(scene, img, updatefn=None):
+    """ render scene into img like render_ray.raytrace, with a
+    visibility pass into a GBuffer followed by shading of the whole
+    buffer. updatefn is called once after each pass. Without NumPy the
+    scene is traced by raytrace. """
+    if np is None:
+        raytrace(scene, img, updatefn)
+        return
+    gbuf = GBuffer(img.size)
+    gbuf.fill(scene)
+    if updatefn:
+        updatefn()
+    colors = shade_gbuffer(scene, gbuf)
+    pixels = np.minimum(np.round(colors*255), 255).astype(np.uint8)
+    w, h = img.size
+    img.set_tile((0, 0, w, h), pixels.tobytes())
+    if updatefn:
+        updatefn()
@@ -0,0 +1,566 @@
+# render_packet.py
+#    Packet ray tracing with NumPy (optional)
+#
+# Rays are traced a tile at a time as arrays. The scene's objects are
+# packed into arrays (spheres, boxes, squares and triangles, each
+# possibly under one Transformable), and a packet is pushed through the
+# BVHs breadth first: each step tests every (ray, node) pair at once,
+# so the Python loop runs once per tree level rather than once per node.
+# The candidate (ray, primitive) pairs at the leaves are intersected
+# with one vectorized test per kind of primitive and the closest hit
+# for each ray is kept. The hits are shaded with
+# render_deferred.shade_buffers.
+#
+# Scenes with other kinds of surfaces are traced by render_ray.raytrace
+# instead, and rays that hit a textured surface (when textures are on)
+# are handed to render_ray.raycolor.
+
+from math import inf
+
+from ren3d.models import Box, Sphere, Square, Transformable, Record
+from ren3d.mesh import Mesh, Triangle
+from ren3d.bvh import build_index_BVH, FlatBVH
+from ren3d.ray3d import Ray, Interval
+from ren3d.math3d import Point, Vector
+from ren3d.render_ray import (raytrace, raycolor, make_tiles, TILE_SIZE,
+                              EPSILON)
+from ren3d.render_deferred import shade_buffers
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# kinds of primitive
+SPHERE, BOX, SQUARE, TRIANGLE, MESH = range(5)
+_KINDS = {Sphere: SPHERE, Box: BOX, Square: SQUARE, Triangle: TRIANGLE,
+          Mesh: MESH}
+
+
+def packet_support(scene):
+    """return None if scene can be traced by PacketTracer, otherwise a
+    string saying why not"""
+    if np is None:
+        return "NumPy is not available"
+    for obj in _scene_objects(scene):
+        if isinstance(obj, Transformable):
+            obj = obj.surface
+        if type(obj) not in _KINDS:
+            return "unsupported surface: {}".format(type(obj).__name__)
+    return None
+
+
+def raytrace_packets(scene, img, updatefn=None, tilesize=TILE_SIZE):
+    """render scene into img like render_ray.raytrace, tracing each tile
+    of tilesize pixels as one packet. updatefn is called as each tile
+    is finished. Falls back to raytrace when the scene is not supported
+    (see packet_support).
+    """
+    if packet_support(scene) is not None:
+        raytrace(scene, img, updatefn)
+        return
+    camera = scene.camera
+    camera.set_resolution(*img.size)
+    tracer = PacketTracer(scene)
+    for tile in make_tiles(img.size, tilesize):
+        dirs = camera.tile_directions(tile).reshape(-1, 3)
+        orgs = np.broadcast_to(np.array(tuple(camera.eye)), dirs.shape)
+        colors = tracer.trace(orgs, dirs, 0.0, inf, scene.reflections)
+        pixels = np.minimum(np.round(colors*255), 255).astype(np.uint8)
+        img.set_tile(tile, pixels.tobytes())
+        if updatefn:
+            updatefn()
+
+
+def _scene_objects(scene):
+    # the primitives of the compiled scene (see Scene.surface)
+    surface = scene.surface
+    if isinstance(surface, FlatBVH):
+        return surface.prims
+    return surface.objects
+
+
+def _flat_arrays(bvh):
+    # a FlatBVH's node bounds, second child/first primitive, and count
+    bounds = np.array(bvh.bounds).reshape(-1, 6)
+    nodes = np.array(bvh.nodes, dtype=np.int64).reshape(-1, 3)
+    return [bounds, nodes[:, 0], nodes[:, 1]]
+
+
+class PacketTracer:
+    """The surfaces of a scene packed into arrays for packet tracing.
+
+    Each object (a primitive of the compiled scene) has a kind, an
+    index into the arrays for that kind, a material and an optional
+    transform. Meshes are objects whose triangles are reached through
+    their own BVHs, which are merged into one set of arrays.
+    """
+
+    def __init__(self, scene):
+        self.scene = scene
+        objects = list(_scene_objects(scene))
+        self.objects = objects
+        self._materials = {}
+        self._matlist = []
+
+        n = len(objects)
+        self.obj_kind = np.zeros(n, dtype=np.int64)
+        self.obj_index = np.zeros(n, dtype=np.int64)
+        self.obj_xform = np.full(n, -1, dtype=np.int64)
+        self.obj_mat = np.zeros(n, dtype=np.int64)
+        self.obj_texture = np.zeros(n, dtype=bool)
+        xforms, ixforms, nxforms = [], [], []
+        spheres, boxes, squares = [], [], []
+        tris = Record(p0=[], edges=[], n0=[], n1=[], n2=[], mat=[])
+        meshes = []
+        for i, obj in enumerate(objects):
+            if isinstance(obj, Transformable):
+                self.obj_xform[i] = len(xforms)
+                xforms.append(obj.trans.m)
+                ixforms.append(obj.itrans.m)
+                nxforms.append(obj.ntrans.m)
+                obj = obj.surface
+            kind = self.obj_kind[i] = _KINDS[type(obj)]
+            if kind == MESH:
+                self.obj_index[i] = len(meshes)
+                meshes.append(obj)
+                self.obj_mat[i] = self._material(obj.store.color)
+                continue
+            self.obj_mat[i] = self._material(obj.color)
+            self.obj_texture[i] = bool(scene.textures and obj.texture)
+            if kind == SPHERE:
+                self.obj_index[i] = len(spheres)
+                spheres.append(tuple(obj.pos) + (obj.radius,))
+            elif kind == BOX:
+                self.obj_index[i] = len(boxes)
+                boxes.append([v for plane in obj.planes for v in plane])
+            elif kind == SQUARE:
+                self.obj_index[i] = len(squares)
+                squares.append(tuple(obj.normal))
+            else:
+                self.obj_index[i] = len(tris.p0)
+                p0, p1, p2 = obj.points
+                tris.p0.append(tuple(p0))
+                tris.edges.append(tuple(p0-p1) + tuple(p0-p2))
+                for name, normal in zip(("n0", "n1", "n2"), obj.normals):
+                    getattr(tris, name).append(tuple(normal))
+                tris.mat.append(self.obj_mat[i])
+
+        self.xforms = np.array(xforms).reshape(-1, 12)
+        self.ixforms = np.array(ixforms).reshape(-1, 12)
+        self.nxforms = np.array(nxforms).reshape(-1, 12)
+        self.spheres = np.array(spheres).reshape(-1, 4)
+        self.boxes = np.array(boxes).reshape(-1, 6)
+        self.squares = np.array(squares).reshape(-1, 3)
+        self._pack_meshes(meshes, tris)
+
+        # top level BVH over the objects
+        surface = scene.surface
+        if isinstance(surface, FlatBVH):
+            top = surface
+            prims = range(len(objects))
+        else:
+            boxes = [tuple(obj.bbox.bounds[0]) + tuple(obj.bbox.bounds[1])
+                     for obj in objects]
+            top = FlatBVH(build_index_BVH(boxes))
+            prims = top.prims
+        self.top = _flat_arrays(top) + [np.array(prims, dtype=np.int64)]
+
+        mats = self._matlist
+        self.ambient = np.array([tuple(m.ambient) for m in mats])
+        self.diffuse = np.array([tuple(m.diffuse) for m in mats])
+        self.specular = np.array([tuple(m.specular) for m in mats])
+        self.shininess = np.array([float(m.shininess) for m in mats])
+        self.reflect = np.array([tuple(m.reflect or (0, 0, 0))
+                                 for m in mats])
+        self.reflective = np.array([bool(m.reflect) for m in mats])
+
+    def _material(self, mat):
+        if id(mat) not in self._materials:
+            self._materials[id(mat)] = len(self._matlist)
+            self._matlist.append(mat)
+        return self._materials[id(mat)]
+
+    def _pack_meshes(self, meshes, tris):
+        # merge the triangles of the meshes (after any scene Triangles)
+        # and their BVHs, offsetting node and triangle indexes
+        p0, edges = [np.array(tris.p0).reshape(-1, 3),
+                     np.array(tris.edges).reshape(-1, 6)]
+        n0, n1, n2 = [np.array(getattr(tris, name)).reshape(-1, 3)
+                      for name in ("n0", "n1", "n2")]
+        mat = [np.array(tris.mat, dtype=np.int64)]
+        p0, edges, n0, n1, n2 = [p0], [edges], [n0], [n1], [n2]
+        roots, bounds, seconds, counts, prims = [], [], [], [], []
+        ntris = len(tris.p0)
+        nnodes = nprims = 0
+        for mesh in meshes:
+            store = mesh.store
+            verts = np.array(store.verts).reshape(-1, 3)
+            faces = np.array(store.faces, dtype=np.int64).reshape(-1, 3)
+            normals = np.array(store.normals).reshape(-1, 3)
+            nindexes = np.array(store.nindexes, dtype=np.int64).reshape(-1, 3)
+            p0.append(verts[faces[:, 0]])
+            edges.append(np.array(store.edges).reshape(-1, 6))
+            n0.append(normals[nindexes[:, 0]])
+            n1.append(normals[nindexes[:, 1]])
+            n2.append(normals[nindexes[:, 2]])
+            mat.append(np.full(len(faces), self._material(store.color)))
+
+            bound, second, count = _flat_arrays(mesh.surface)
+            inner = count == 0
+            roots.append(nnodes)
+            bounds.append(bound)
+            # second children of inner nodes, first primitives of leaves
+            seconds.append(np.where(inner, second+nnodes, second+nprims))
+            counts.append(count)
+            prims.append(np.array(mesh.surface.prims, dtype=np.int64)
+                         + ntris)
+            nnodes += len(count)
+            nprims += len(mesh.surface.prims)
+            ntris += len(faces)
+
+        self.tri_p0 = np.concatenate(p0)
+        self.tri_edges = np.concatenate(edges)
+        self.tri_n = [np.concatenate(n) for n in (n0, n1, n2)]
+        self.tri_mat = np.concatenate(mat)
+        self.mesh_roots = np.array(roots, dtype=np.int64)
+        if meshes:
+            self.mesh_bvh = [np.concatenate(a) for a in
+                             (bounds, seconds, counts, prims)]
+
+    # ------------------------------------------------------------------
+    # tracing
+
+    def trace(self, orgs, dirs, low, high, depth):
+        """return the colors (an n x 3 array) of the rays with origins
+        orgs and directions dirs (n x 3 arrays) over the interval
+        (low, high), following depth levels of reflection"""
+        n = len(dirs)
+        colors = np.empty((n, 3))
+        colors[:] = tuple(self.scene.background)
+        hit = self.closest_hits(orgs, dirs, low, high)
+        if hit is None:
+            return colors
+
+        # rays that hit textured surfaces are left to raycolor
+        textured = self.obj_texture[hit.obj]
+        if textured.any():
+            hits = []
+            for k in np.flatnonzero(textured):
+                r = hit.ray[k]
+                ray = Ray(Point(orgs[r]), Vector(dirs[r]))
+                colors[r] = tuple(raycolor(self.scene, ray,
+                                           Interval(low, high), depth, hits))
+            hit = _select(hit, ~textured)
+        if len(hit.ray):
+            colors[hit.ray] = self.shade(hit, dirs[hit.ray], depth)
+        return colors
+
+    def shade(self, hit, dirs, depth):
+        # Blinn-Phong shading as in render_ray.raycolor
+        mat = hit.mat
+        color = shade_buffers(
+            self.scene, hit.point, hit.normal, dirs, self.ambient[mat],
+            self.diffuse[mat], self.specular[mat], self.shininess[mat],
+            lambda points, lvecs: self.occluded(points, lvecs, EPSILON, 1))
+        if depth > 0:
+            refl = np.flatnonzero(self.reflective[mat])
+            if len(refl):
+                d, n = dirs[refl], hit.normal[refl]
+                s = 2*_dot(d, n)
+                rdirs = d - s[:, None]*n
+                rcolors = self.trace(hit.point[refl], rdirs, EPSILON, inf,
+                                     depth-1)
+                color[refl] = color[refl] + rcolors * self.reflect[mat[refl]]
+        return color
+
+    def closest_hits(self, orgs, dirs, low, high):
+        """the closest hit of each ray that hits something, as a Record
+        of arrays: ray (index of the ray), t, obj, mat, point and normal
+        (in world space). None if no ray hits."""
+        highs = np.full(len(dirs), float(high))
+        cands = []
+        for ray, obj in _traverse(self.top, orgs, dirs, low, highs):
+            cands.append(self._intersect(ray, obj, orgs, dirs, low, highs,
+                                         False))
+        cand = _concat(cands)
+        if cand is None:
+            return None
+
+        # keep the closest candidate for each ray
+        order = np.lexsort((cand.t, cand.ray))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = cand.ray[order[1:]] != cand.ray[order[:-1]]
+        hit = _select(cand, order[first])
+
+        # hit points and normals, moved into world space if need be
+        hit.point = hit.s + hit.t[:, None]*hit.d
+        hit.normal = self._normals(hit, hit.point)
+        xf = self.obj_xform[hit.obj]
+        moved = xf >= 0
+        if moved.any():
+            hit.point[moved] = _apply_point(self.xforms[xf[moved]],
+                                            hit.point[moved])
+            normal = _apply_vector(self.nxforms[xf[moved]],
+                                   hit.normal[moved])
+            hit.normal[moved] = normal / _mag(normal)[:, None]
+        hit.mat = self.obj_mat[hit.obj]
+        tri = hit.kind == TRIANGLE
+        hit.mat[tri] = self.tri_mat[hit.index[tri]]
+        return hit
+
+    def occluded(self, orgs, dirs, low, high):
+        """a boolean array that is True for the rays that hit anything
+        within (low, high). A ray drops out of the search at its first
+        hit."""
+        highs = np.full(len(dirs), float(high))
+        for ray, obj in _traverse(self.top, orgs, dirs, low, highs):
+            self._intersect(ray, obj, orgs, dirs, low, highs, True)
+        return highs == -inf
+
+    def _intersect(self, ray, obj, orgs, dirs, low, highs, anyhit):
+        # intersect the rays with the objects of the candidate pairs
+        # (ray, obj), returning a Record of the hits including the rays in
+        # object space (s, d). highs is lowered to the closest hit of each
+        # ray, or to -inf if anyhit, which ends the search for that ray.
+        xf = self.obj_xform[obj]
+        s, d = orgs[ray], dirs[ray]
+        moved = xf >= 0
+        if moved.any():
+            m = self.ixforms[xf[moved]]
+            s[moved] = _apply_point(m, s[moved])
+            d[moved] = _apply_vector(m, d[moved])
+
+        cands = []
+        kind, index = self.obj_kind[obj], self.obj_index[obj]
+        for k, test in ((SPHERE, self._spheres), (BOX, self._boxes),
+                        (SQUARE, self._squares), (TRIANGLE, self._tris)):
+            sel = np.flatnonzero(kind == k)
+            if len(sel):
+                cands.append(test(sel, index[sel], s[sel], d[sel],
+                                  low, highs[ray[sel]]))
+        sel = np.flatnonzero(kind == MESH)
+        if len(sel):
+            ms, md = s[sel], d[sel]
+            mhighs = highs[ray[sel]]
+            roots = self.mesh_roots[index[sel]]
+            for pair, tri in _traverse(self.mesh_bvh, ms, md, low, mhighs,
+                                       roots):
+                c = self._tris(pair, tri, ms[pair], md[pair], low,
+                               mhighs[pair])
+                _lower(mhighs, c.pair, c.t, anyhit)
+                c.pair = sel[c.pair]
+                cands.append(c)
+        cand = _concat(cands)
+        if cand is None:
+            return None
+        cand.ray = ray[cand.pair]
+        cand.obj = obj[cand.pair]
+        cand.s, cand.d = s[cand.pair], d[cand.pair]
+        _lower(highs, cand.ray, cand.t, anyhit)
+        return cand
+
+    def _normals(self, hit, point):
+        # unit normals (in object space) at the hit points
+        normal = np.zeros((len(hit.t), 3))
+        kind = hit.kind
+        sel = kind == SPHERE
+        if sel.any():
+            n = point[sel] - self.spheres[hit.index[sel], :3]
+            normal[sel] = n / _mag(n)[:, None]
+        sel = np.flatnonzero(kind == BOX)
+        if len(sel):
+            face = hit.face[sel]
+            normal[sel, face // 2] = np.where(face % 2, 1.0, -1.0)
+        sel = kind == SQUARE
+        if sel.any():
+            normal[sel] = self.squares[hit.index[sel]]
+        sel = kind == TRIANGLE
+        if sel.any():
+            tri = hit.index[sel]
+            beta, gamma = hit.beta[sel, None], hit.gamma[sel, None]
+            n0, n1, n2 = [n[tri] for n in self.tri_n]
+            n = (1 - beta - gamma)*n0 + beta*n1 + gamma*n2
+            normal[sel] = n / _mag(n)[:, None]
+        return normal
+
+    # Each intersection test takes the indexes of the candidate pairs,
+    # the indexes of the primitives of its kind, the pairs' rays, and
+    # the interval; it returns a Record of the pairs that hit.
+
+    def _spheres(self, pair, index, s, d, low, high):
+        sph = self.spheres[index]
+        sp = s - sph[:, :3]
+        a = _dot(d, d)
+        b = 2 * _dot(d, sp)
+        c = _dot(sp, sp) - sph[:, 3]*sph[:, 3]
+        discrim = b*b - 4 * a * c
+        ok = discrim > 0
+        discrt = np.sqrt(np.where(ok, discrim, 0.0))
+        t1 = (-b - discrt)/(2*a)
+        t2 = (-b + discrt)/(2*a)
+        t = np.where((low < t1) & (t1 < high), t1,
+                     np.where((t1 < low) & (low < t2) & (t2 < high), t2,
+                              inf))
+        keep = ok & (t < inf)
+        return _record(pair, index, t, keep, SPHERE)
+
+    def _boxes(self, pair, index, s, d, low, high):
+        planes = self.boxes[index]
+        ts = np.full((len(pair), 6), inf)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for axis in range(3):
+                others = [a for a in range(3) if a != axis]
+                for lh in range(2):
+                    f = 2*axis + lh
+                    t = (planes[:, f] - s[:, axis])/d[:, axis]
+                    ok = (d[:, axis] != 0) & (low < t) & (t < high)
+                    for a in others:
+                        p = s[:, a] + t*d[:, a]
+                        ok &= (planes[:, 2*a] <= p) & (p <= planes[:, 2*a+1])
+                    ts[:, f] = np.where(ok, t, inf)
+        face = np.argmin(ts, axis=1)
+        t = ts[np.arange(len(pair)), face]
+        rec = _record(pair, index, t, t < inf, BOX)
+        rec.face = face[t < inf]
+        return rec
+
+    def _squares(self, pair, index, s, d, low, high):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = -s[:, 1]/d[:, 1]
+            x = s[:, 0] + t*d[:, 0]
+            z = s[:, 2] + t*d[:, 2]
+            keep = ((d[:, 1] != 0) & (low < t) & (t < high)
+                    & (-.5 <= x) & (x <= .5) & (-.5 <= z) & (z <= .5))
+        return _record(pair, index, t, keep, SQUARE)
+
+    def _tris(self, pair, index, s, d, low, high):
+        a, b, c, dd, e, f = self.tri_edges[index].T
+        g, h, i = d.T
+        ei_hf = e*i - h*f
+        gf_di = g*f - dd*i
+        dh_eg = dd*h - e*g
+        den = a*ei_hf + b*gf_di + c*dh_eg
+        p0 = self.tri_p0[index]
+        j, k, l = (p0 - s).T
+        bl_kc = b*l - k*c
+        jc_al = j*c - a*l
+        ak_jb = a*k - j*b
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = -(dd*bl_kc + e*jc_al + f*ak_jb) / den
+            beta = (j*ei_hf + k*gf_di + l*dh_eg) / den
+            gamma = (g*bl_kc + h*jc_al + i*ak_jb) / den
+            keep = ((den != 0) & (low < t) & (t < high)
+                    & (beta >= 0) & (beta <= 1)
+                    & (gamma >= 0) & (gamma + beta <= 1))
+        rec = _record(pair, index, t, keep, TRIANGLE)
+        rec.beta, rec.gamma = beta[keep], gamma[keep]
+        return rec
+
+
+def _dot(a, b):
+    return a[:, 0]*b[:, 0] + a[:, 1]*b[:, 1] + a[:, 2]*b[:, 2]
+
+
+def _mag(a):
+    return np.sqrt(_dot(a, a))
+
+
+def _apply_point(m, p):
+    # apply the affine matrices m (n x 12 rows) to the points p
+    x, y, z = p[:, 0], p[:, 1], p[:, 2]
+    return np.stack([m[:, 0]*x + m[:, 1]*y + m[:, 2]*z + m[:, 3],
+                     m[:, 4]*x + m[:, 5]*y + m[:, 6]*z + m[:, 7],
+                     m[:, 8]*x + m[:, 9]*y + m[:, 10]*z + m[:, 11]], axis=1)
+
+
+def _apply_vector(m, v):
+    x, y, z = v[:, 0], v[:, 1], v[:, 2]
+    return np.stack([m[:, 0]*x + m[:, 1]*y + m[:, 2]*z,
+                     m[:, 4]*x + m[:, 5]*y + m[:, 6]*z,
+                     m[:, 8]*x + m[:, 9]*y + m[:, 10]*z], axis=1)
+
+
+def _record(pair, index, t, keep, kind):
+    return Record(pair=pair[keep], index=index[keep], t=t[keep],
+                  kind=np.full(int(keep.sum()), kind))
+
+
+_FIELDS = ("pair", "index", "t", "kind", "face", "beta", "gamma")
+_INTS = ("pair", "index", "kind", "face")
+
+
+def _lower(highs, index, t, anyhit):
+    # lower highs[index] to t, or end the search for index if anyhit
+    if anyhit:
+        highs[index] = -inf
+    else:
+        np.minimum.at(highs, index, t)
+
+
+def _concat(cands):
+    # merge candidate records of different kinds (fields that a kind
+    # does not have are filled with zeros)
+    cands = [c for c in cands if c is not None and len(c.t)]
+    if not cands:
+        return None
+    merged = Record()
+    for name in vars(cands[0]).keys() | set(_FIELDS):
+        parts = [getattr(c, name, None) for c in cands]
+        parts = [np.zeros(len(c.t)) if p is None else p
+                 for c, p in zip(cands, parts)]
+        setattr(merged, name, np.concatenate(parts))
+    for name in _INTS:
+        setattr(merged, name, getattr(merged, name).astype(np.int64))
+    return merged
+
+
+def _select(rec, sel):
+    # Record of the array fields of rec indexed by sel
+    return Record(**{name: value[sel] for name, value in vars(rec).items()})
+
+
+def _traverse(bvh, orgs, dirs, low, highs, roots=None):
+    """ push the rays (orgs, dirs) through the flattened BVH arrays bvh
+    (node bounds, second child or first primitive, primitive count,
+    primitives) breadth first, starting ray k at node
+    roots[k] (default: the root).
+
+    Each level yields the arrays (ray indexes, primitives) of the leaf
+    primitives whose bounds the rays enter within (low, highs[ray]).
+    The caller may lower highs before resuming, to prune the rest of
+    the search.
+    """
+    bounds, second, count, prims = bvh
+    lows, highs_ = bounds[:, :3], bounds[:, 3:]
+    with np.errstate(divide="ignore"):
+        inv = np.where(dirs != 0, 1/np.where(dirs != 0, dirs, 1), inf)
+    ray = np.arange(len(dirs))
+    node = np.zeros(len(dirs), dtype=np.int64) if roots is None else roots
+    while len(ray):
+        # slab test, ignoring the nan from 0*inf as FlatBVH does
+        s, iv = orgs[ray], inv[ray]
+        with np.errstate(invalid="ignore"):
+            t0 = (lows[node] - s) * iv
+            t1 = (highs_[node] - s) * iv
+        forward = iv >= 0
+        near = np.where(forward, t0, t1)
+        far = np.where(forward, t1, t0)
+        tnear = np.fmax(np.fmax(np.fmax(near[:, 0], near[:, 1]),
+                                near[:, 2]), low)
+        tfar = np.fmin(np.fmin(np.fmin(far[:, 0], far[:, 1]), far[:, 2]),
+                       highs[ray])
+        hit = tnear <= tfar
+        ray, node = ray[hit], node[hit]
+        n = count[node]
+        leaf = n > 0
+        if leaf.any():
+            lray, lnode, n = ray[leaf], node[leaf], n[leaf]
+            total = int(n.sum())
+            start = np.repeat(second[lnode], n)
+            offset = np.arange(total) - np.repeat(np.cumsum(n) - n, n)
+            yield np.repeat(lray, n), prims[start + offset]
+        inner = ~leaf
+        ray, node = ray[inner], node[inner]
+        ray = np.concatenate((ray, ray))
+        node = np.concatenate((node+1, second[node]))
@@ -2,9 +2,14 @@
 #    Ray tracing rendering algorithms
 
 from ren3d.ray3d import Interval, Point, Ray
-from ren3d.models import Record
+from ren3d.models import Record, HitRecord
 from ren3d.rgb import RGB
+from ren3d.image import SharedImage
 from math import inf
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+import os
 
 EPSILON = 10e-12
 
@@ -13,13 +18,14 @@ def raytrace_chunk(scene, imagesize, lineinc, startline, updatefn=None):
     w, h = imagesize
     camera.set_resolution(w, h)
     lines = []
+    hits = []
     for j in range(h):
         if (j-startline)/lineinc != (j-startline)//lineinc:
             continue
         line = []
         for i in range(w):
             ray = camera.ij_ray(i, j)
-            color = raycolor(scene, ray, Interval(), scene.reflections)
+            color = raycolor(scene, ray, Interval(), scene.reflections, hits)
             line.append(color.quantize(255))
         lines.append(line)
         if updatefn:
@@ -33,23 +39,395 @@ def raytrace(scene, img, updatefn=None):
     camera = scene.camera
     w, h = img.size
     camera.set_resolution(w, h)
+    hits = []
     for j in range(h):
-        for i in range(w):
-            ray = camera.ij_ray(i, j)
-            color = raycolor(scene, ray, Interval(), scene.reflections)
+        for i, ray in enumerate(camera.row_rays(j)):
+            color = raycolor(scene, ray, Interval(), scene.reflections, hits)
+            img[i, j] = color.quantize(255)
+        if updatefn:
+            updatefn()
+
+
+def raytrace_progressive(scene, img, block=8, budget=None, updatefn=None):
+    """render scene into img coarse to fine. The first pass traces every
+    block'th pixel in each direction and fills the block x block square
+    above and to the right of it with its color; each later pass halves
+    the block size (rounding down) and traces the pixels on the finer
+    grid that have not been traced yet, filling only untraced pixels.
+    Every pixel is traced once, with the same ray as raytrace, so the
+    finished image is the same. If budget (in seconds) runs out after
+    the first pass, rendering stops after the current row. updatefn is
+    called after each row of each pass. Returns the block size of the
+    finest finished pass (1 when the image is complete).
+
+    >>> from ren3d.scenedef import Scene, Sphere
+    >>> from ren3d.image import Image
+    >>> s = Scene()
+    >>> s.add(Sphere(pos=(0, 0, -5), radius=1.5))
+    >>> full = Image((13, 9))
+    >>> raytrace(s, full)
+    >>> for block in (8, 6, 5, 1):
+    ...     img = Image((13, 9))
+    ...     done = raytrace_progressive(s, img, block)
+    ...     print(block, done, img.pixels == full.pixels)
+    8 1 True
+    6 1 True
+    5 1 True
+    1 1 True
+    """
+    if block < 1:
+        raise ValueError("block must be at least 1: {}".format(block))
+    camera = scene.camera
+    w, h = img.size
+    camera.set_resolution(w, h)
+    start = perf_counter()
+    traced = bytearray(w*h)     # 1 for each pixel traced so far
+    hits = []
+    step = block
+    done = None
+    while step >= 1:
+        for j in range(0, h, step):
+            rows = min(step, h-j)
+            for i, ray in zip(range(0, w, step),
+                              camera.row_rays(j, 0, w, step)):
+                if traced[j*w+i]:
+                    continue
+                traced[j*w+i] = 1
+                color = raycolor(scene, ray, Interval(), scene.reflections,
+                                 hits)
+                rgb = color.quantize(255)
+                if step == 1:
+                    img[i, j] = rgb
+                    continue
+                cols = min(step, w-i)
+                for y in range(j, j+rows):
+                    first = i+1 if y == j else i
+                    if not any(traced[y*w+first:y*w+i+cols]):
+                        img.set_tile((i, y, i+cols, y+1), bytes(rgb) * cols)
+                    else:
+                        # keep pixels already traced (when block is not
+                        # a power of two, the grids are not nested)
+                        for x in range(i, i+cols):
+                            if not traced[y*w+x] or (x, y) == (i, j):
+                                img[x, y] = rgb
+            if updatefn:
+                updatefn()
+            if (done is not None and budget is not None
+                    and perf_counter()-start > budget):
+                return done
+        done = step
+        step //= 2
+    return done
+
+# ----------------------------------------------------------------------
+# Tile-based parallel ray tracing
+#   A tile is a rectangle of pixels (x0, y0, x1, y1), x1 and y1 exclusive.
+
+TILE_SIZE = (32, 32)
+
+
+def make_tiles(size, tilesize=TILE_SIZE):
+    """return a list of the tiles covering an image of the given size
+
+    >>> make_tiles((5, 3), (2, 2))
+    [(0, 0, 2, 2), (2, 0, 4, 2), (4, 0, 5, 2), (0, 2, 2, 3), (2, 2, 4, 3), (4, 2, 5, 3)]
+    """
+    w, h = size
+    tw, th = tilesize
+    return [(x, y, min(x+tw, w), min(y+th, h))
+            for y in range(0, h, th) for x in range(0, w, tw)]
+
+
+def raytrace_tile(scene, tile):
+    """return the pixels of tile as bytes of r, g, b values, row by row
+    from the bottom (the camera resolution must already be set)"""
+    pixels = array("B")
+    hits = []
+    for i, j, ray in scene.camera.tile_rays(tile):
+        color = raycolor(scene, ray, Interval(), scene.reflections, hits)
+        pixels.extend(color.quantize(255))
+    return pixels.tobytes()
+
+
+def estimate_tile_costs(scene, tiles, samples=2):
+    """return a list of the estimated costs of tracing tiles, measured by
+    timing a samples x samples grid of rays spread over each tile
+    (the camera resolution must already be set)"""
+    camera = scene.camera
+    costs = []
+    hits = []
+    for x0, y0, x1, y1 in tiles:
+        start = perf_counter()
+        for sj in range(samples):
+            j = y0 + (y1-y0) * (sj+.5) / samples - .5
+            for si in range(samples):
+                i = x0 + (x1-x0) * (si+.5) / samples - .5
+                raycolor(scene, camera.ij_ray(i, j), Interval(),
+                         scene.reflections, hits)
+        costs.append((perf_counter()-start) * (x1-x0) * (y1-y0))
+    return costs
+
+
+def _morton(x, y):
+    # interleave the bits of x and y
+    code = 0
+    for bit in range(16):
+        code |= ((x >> bit) & 1) << (2*bit) | ((y >> bit) & 1) << (2*bit+1)
+    return code
+
+
+def order_tiles(scene, tiles, order="cost"):
+    """return tiles in the order they should be handed out:
+      "cost": most expensive (by estimate_tile_costs) first, so the cheap
+              tiles fill in the gaps at the end
+      "locality": along a Z-order curve, so neighbouring tiles go out
+              together
+      "scanline": as given
+    """
+    if order == "cost":
+        costs = estimate_tile_costs(scene, tiles)
+        ranked = sorted(zip(costs, range(len(tiles))), reverse=True)
+        return [tiles[i] for cost, i in ranked]
+    if order == "locality":
+        tw = tiles[0][2] - tiles[0][0]
+        th = tiles[0][3] - tiles[0][1]
+        return sorted(tiles, key=lambda t: _morton(t[0]//tw, t[1]//th))
+    if order == "scanline":
+        return list(tiles)
+    raise ValueError("Unknown tile order: {}".format(order))
+
+
+# Each worker process of raytrace_parallel loads its own copy of the
+# scene and attaches to the shared image that the tiles are drawn into
+_worker_scene = None
+_worker_image = None
+
+
+def _init_worker(scenename, size, imagename):
+    global _worker_scene, _worker_image
+    from ren3d.scenedef import load_scene
+    _worker_scene, modname = load_scene(scenename)
+    _worker_scene.camera.set_resolution(*size)
+    _worker_image = SharedImage(size, imagename)
+
+
+def _worker_tile(tile):
+    lookups, hits = shadow_cache.lookups, shadow_cache.hits
+    _worker_image.set_tile(tile, raytrace_tile(_worker_scene, tile))
+    return tile, shadow_cache.lookups-lookups, shadow_cache.hits-hits
+
+
+def raytrace_parallel(scenename, img, nworkers=None, updatefn=None,
+                      tilesize=TILE_SIZE, order="cost", scene=None):
+    """raytrace the scene defined in module scenename into img using a
+    pool of nworkers processes (default: one per core). Each worker
+    loads the scene once. The image is split into tiles of tilesize
+    which are queued in the given order (see order_tiles) and handed to
+    workers as they become free; updatefn is called as each tile is
+    finished.
+
+    The "cost" order is worked out in this process before the workers
+    start, by tracing a few rays per tile of the scene. Callers that
+    have already loaded the scene from scenename pass it as scene;
+    otherwise it is loaded here as well.
+
+    Workers write their pixels straight into the shared memory of img
+    if it is a SharedImage; otherwise they share a temporary image that
+    is copied into img at the end.
+    """
+    tiles = make_tiles(img.size, tilesize)
+    if order == "cost":
+        if scene is None:
+            from ren3d.scenedef import load_scene
+            scene, modname = load_scene(scenename)
+        scene.camera.set_resolution(*img.size)
+        tiles = order_tiles(scene, tiles, order)
+    else:
+        tiles = order_tiles(None, tiles, order)
+    nworkers = nworkers or os.cpu_count()
+    target = img if isinstance(img, SharedImage) else SharedImage(img.size)
+    try:
+        with ProcessPoolExecutor(nworkers, initializer=_init_worker,
+                                 initargs=(scenename, img.size,
+                                           target.name)) as pool:
+            # each finished job only reports which tile is done and the
+            # shadow cache counts for it
+            jobs = [pool.submit(_worker_tile, tile) for tile in tiles]
+            for job in as_completed(jobs):
+                tile, lookups, hits = job.result()
+                shadow_cache.lookups += lookups
+                shadow_cache.hits += hits
+                if updatefn:
+                    updatefn()
+        if target is not img:
+            img.pixels[:] = array("B", target.pixels)
+    finally:
+        if target is not img:
+            target.close()
+
+
+# ----------------------------------------------------------------------
+# Adaptive antialiasing
+#   Every pixel first gets one ray through its centre. Pixels that differ
+#   from a neighbour by more than threshold (in some channel) are then
+#   supersampled on a stratified grid, four samples at a time, until the
+#   samples agree or the grid is used up. The most contrasting pixels are
+#   refined first, so a sample budget goes where aliasing is worst.
+
+
+def _color_diff(a, b):
+    return max(abs(a.r-b.r), abs(a.g-b.g), abs(a.b-b.b))
+
+
+def _contrasts(colors, w, h):
+    # largest difference between each pixel and its 4-neighbours
+    contrast = [0.0] * (w*h)
+    for k, c in enumerate(colors):
+        if k % w != w-1:
+            d = _color_diff(c, colors[k+1])
+            contrast[k] = max(contrast[k], d)
+            contrast[k+1] = max(contrast[k+1], d)
+        if k+w < w*h:
+            d = _color_diff(c, colors[k+w])
+            contrast[k] = max(contrast[k], d)
+            contrast[k+w] = max(contrast[k+w], d)
+    return contrast
+
+
+def sample_offsets(grid):
+    """the offsets from the pixel centre of the samples of a grid x grid
+    stratified pattern, ordered so that each run of four is spread over
+    the pixel
+
+    >>> sample_offsets(2)
+    [(-0.25, -0.25), (-0.25, 0.25), (0.25, -0.25), (0.25, 0.25)]
+    >>> sample_offsets(4)[:4]
+    [(-0.375, -0.375), (-0.375, 0.125), (0.125, -0.375), (0.125, 0.125)]
+    """
+    cells = sorted(((a % 2, b % 2, a, b) for a in range(grid)
+                    for b in range(grid)))
+    return [((a+.5)/grid - .5, (b+.5)/grid - .5) for _, _, a, b in cells]
+
+
+def _refine(scene, i, j, color, threshold, offsets, hits):
+    # supersample pixel (i, j) whose centre has color; returns the mean
+    # color and the number of samples added
+    camera = scene.camera
+    total = color.copy()
+    squares = color * color
+    n = 1
+    for si, sj in offsets:
+        sample = raycolor(scene, camera.ij_ray(i+si, j+sj), Interval(),
+                          scene.reflections, hits)
+        total.iadd(sample)
+        squares.scale_add(1.0, sample, sample)
+        n += 1
+        if n % 4 == 1:
+            # stop once the samples' standard deviation is under
+            # threshold/2 in every channel
+            var = max(sq/n - (t/n)**2 for sq, t in zip(squares, total))
+            if 4 * var < threshold * threshold:
+                break
+    return 1/n * total, n-1
+
+
+def raytrace_adaptive(scene, img, threshold=.1, grid=4, budget=None,
+                      updatefn=None):
+    """render scene into img with adaptive antialiasing. After one ray
+    per pixel, each pixel that differs from a neighbour by more than
+    threshold gets up to grid x grid more samples (see _refine).
+    Refinement stops once budget samples in all, counting the first
+    pass, have been traced (no limit if None); the last pixel refined
+    gets only the samples left, so refinement never overruns budget.
+    updatefn is called after each row of the first pass and at the end.
+    Returns a Record of the number of pixels, samples traced and pixels
+    refined.
+    """
+    camera = scene.camera
+    w, h = img.size
+    camera.set_resolution(w, h)
+    colors = []
+    hits = []
+    for j in range(h):
+        for i, ray in enumerate(camera.row_rays(j)):
+            color = raycolor(scene, ray, Interval(), scene.reflections, hits)
+            colors.append(color)
             img[i, j] = color.quantize(255)
         if updatefn:
             updatefn()
 
+    stats = Record(pixels=w*h, samples=w*h, refined=0)
+    contrast = _contrasts(colors, w, h)
+    edges = sorted((c, k) for k, c in enumerate(contrast) if c > threshold)
+    offsets = sample_offsets(grid)
+    for c, k in reversed(edges):
+        if budget is not None:
+            if stats.samples >= budget:
+                break
+            offsets = offsets[:budget-stats.samples]
+        i, j = k % w, k // w
+        color, n = _refine(scene, i, j, colors[k], threshold, offsets,
+                           hits)
+        img[i, j] = color.quantize(255)
+        stats.samples += n
+        stats.refined += 1
+    if updatefn:
+        updatefn()
+    return stats
+
+
+# Shadow rays toward a light from neighbouring points are usually
+# blocked by the same surface, so the last surface found blocking each
+# light (by index) is kept in scene.occluders and tested before
+# searching the whole scene. The scene clears it whenever its surface
+# changes. The lookups and hits counts give the cache hit rate.
+shadow_cache = Record(lookups=0, hits=0)
 
-def raycolor(scene, ray, interval, reflections):
-    """returns the color of ray in the scene
+
+def shadow_cache_report():
+    """a line describing the shadow cache hit rate, or None if the cache
+    has not been used"""
+    if not shadow_cache.lookups:
+        return None
+    return "shadow occluder cache: {} of {} hits ({:.1%})".format(
+        shadow_cache.hits, shadow_cache.lookups,
+        shadow_cache.hits/shadow_cache.lookups)
+
+
+def reset_shadow_cache():
+    shadow_cache.lookups = shadow_cache.hits = 0
+
+
+def _shadowed(scene, light, ray):
+    # True iff something blocks ray on its way to light number light
+    occluders = scene.occluders
+    interval = Interval(EPSILON, 1)
+    blocker = occluders.get(light)
+    if blocker is not None:
+        shadow_cache.lookups += 1
+        if blocker.occluded(ray, interval):
+            shadow_cache.hits += 1
+            return True
+    # occlusion tests leave interval unchanged, so it is used again here
+    blocker = occluders[light] = scene.surface.occluder(ray, interval)
+    return blocker is not None
+
+
+def raycolor(scene, ray, interval, reflections, hits=None):
+    """returns the color of ray in the scene. hits is a list of hit
+    records that are reused from ray to ray (one per level of
+    reflection); callers tracing many rays pass in their own list,
+    otherwise fresh records are made.
     """
-    hit = Record()
-    if not scene.objects.intersect(ray, interval, hit):
+    if hits is None:
+        hits = []
+    while len(hits) <= reflections:
+        hits.append(HitRecord())
+    hit = hits[reflections]
+    surface = scene.surface
+    if not surface.intersect(ray, interval, hit):
         return scene.background
 
-    # hitobj = hit.object
     # apply Blinn-Phong shading
     k = hit.color
     if scene.textures and hit.texture:
@@ -59,30 +437,30 @@ def raycolor(scene, ray, interval, reflections):
         ambient = k.ambient
         diffuse = k.diffuse
 
-    # compute ambient color
+    # compute ambient color; the other terms are added into it in place
     color = ambient * scene.ambient
+    vvec = -ray.dir.normalized()
 
     # Lambert component
-    for light in scene.lights:
+    for i, light in enumerate(scene.lights):
         lpos, lcolor = light
         lvec = (lpos-hit.point)
         shadray = Ray(hit.point, lvec)
-        if (scene.shadows
-            and scene.objects.intersect(shadray, Interval(EPSILON, 1), Record())):
+        if scene.shadows and _shadowed(scene, i, shadray):
             continue
         lvec.normalize()
-        color += diffuse * max(0.0, lvec.dot(hit.normal)) * lcolor
+        color.scale_add(max(0.0, lvec.dot(hit.normal)), diffuse, lcolor)
 
         # specular component
-        vvec = -ray.dir.normalized()
         hvec = vvec + lvec
         hvec.normalize()
-        color += max(0.0, hvec.dot(hit.normal))**k.shininess * lcolor * k.specular
+        color.scale_add(max(0.0, hvec.dot(hit.normal))**k.shininess,
+                        lcolor, k.specular)
 
     if k.reflect and reflections > 0:
         refldir = ray.dir.reflection(hit.normal)
         reflray = Ray(hit.point, refldir)
-        color += raycolor(scene, reflray, Interval(EPSILON, inf), reflections-1) * k.reflect
-
+        color.scale_add(1.0, raycolor(scene, reflray, Interval(EPSILON, inf),
+                                      reflections-1, hits), k.reflect)
 
     return color
@@ -1,11 +1,30 @@
 # rgb.py
 #    Calculations on color values
+#
+# RGB colors keep their components in three float slots (r, g, b). The
+# shading loop of the ray tracer accumulates into one color with the
+# in-place methods (iadd, scale_add) instead of building a new RGB for
+# each product and sum.
 
 # ----------------------------------------------------------------------
 
 
+def _rgb(r, g, b):
+    # fast construction from floats
+    c = _new(RGB)
+    c.r = r
+    c.g = g
+    c.b = b
+    return c
+
+
+_new = object.__new__
+
+
 class RGB:
 
+    __slots__ = ("r", "g", "b")
+
     def __init__(self, rgb):
         """ representaiton of color using 3 floating point values
 
@@ -17,7 +36,12 @@ class RGB:
         (1.0, 0.0, 1.0)
         >>>
         """
-        self.values = tuple(float(i) for i in rgb)
+        r, g, b = rgb
+        self.r, self.g, self.b = float(r), float(g), float(b)
+
+    @property
+    def values(self):
+        return (self.r, self.g, self.b)
 
     def __repr__(self):
         """
@@ -32,7 +56,10 @@ class RGB:
         >>> list(c)
         [1.0, 2.0, 3.0]
         """
-        return iter(self.values)
+        return iter((self.r, self.g, self.b))
+
+    def copy(self):
+        return _rgb(self.r, self.g, self.b)
 
     def quantize(self, top):
         """ return a tuple of ints all in range(top+1)
@@ -41,17 +68,20 @@ class RGB:
         >>> RGB((.5, .8, 1.1)).quantize(255)
         (128, 204, 255)
         """
-        return tuple(min(round(v*top), top) for v in self.values)
+        return (min(round(self.r*top), top), min(round(self.g*top), top),
+                min(round(self.b*top), top))
 
     def __mul__(self, other):
         """ RGB multiplication by "scalar" or RGB
 
         >>> .25*RGB((.8, .5, .4))
         RGB((0.2, 0.125, 0.1))
+        >>> RGB((.5, 1, 2)) * RGB((.5, .5, .5))
+        RGB((0.25, 0.5, 1.0))
         """
         if type(other) == RGB:
-            return RGB(a*b for a,b in zip(self, other))
-        return RGB(other*v for v in self)
+            return _rgb(self.r*other.r, self.g*other.g, self.b*other.b)
+        return _rgb(other*self.r, other*self.g, other*self.b)
 
     def __rmul__(self, i):
         """ return a new RGB that is scaled by i
@@ -59,10 +89,46 @@ class RGB:
         >>> RGB((.8, .5, .4))*(.25)
         RGB((0.2, 0.125, 0.1))
         """
-        return RGB(i*v for v in self)
+        return _rgb(i*self.r, i*self.g, i*self.b)
 
     def __add__(self, other):
-        return RGB(a+b for a, b in zip(self, other))
+        """
+        >>> RGB((.1, .2, .3)) + RGB((.5, .5, .5))
+        RGB((0.6, 0.7, 0.8))
+        """
+        return _rgb(self.r+other.r, self.g+other.g, self.b+other.b)
+
+    def iadd(self, other):
+        """ add other into this color
+
+        >>> c = RGB((.25, .5, .5))
+        >>> c.iadd(RGB((.25, 0, .25)))
+        >>> c
+        RGB((0.5, 0.5, 0.75))
+        """
+        self.r += other.r
+        self.g += other.g
+        self.b += other.b
+
+    def scale_add(self, s, other, filter=None):
+        """ add s*other into this color, times filter (an RGB) if given
+
+        >>> c = RGB((.25, .25, .25))
+        >>> c.scale_add(.5, RGB((1, .5, 0)))
+        >>> c
+        RGB((0.75, 0.5, 0.25))
+        >>> c.scale_add(.5, RGB((1, 1, 1)), RGB((.5, 0, 0)))
+        >>> c
+        RGB((1.0, 0.5, 0.25))
+        """
+        if filter is None:
+            self.r += s*other.r
+            self.g += s*other.g
+            self.b += s*other.b
+        else:
+            self.r += s*other.r*filter.r
+            self.g += s*other.g*filter.g
+            self.b += s*other.b*filter.b
 
 
 if __name__ == "__main__":
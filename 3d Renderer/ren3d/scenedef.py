@@ -6,7 +6,9 @@
 from ren3d.math3d import Point
 from ren3d.rgb import RGB
 from ren3d.models import Box, Sphere, Square, Group, Transformable, Cylinder
+from ren3d.models import Animated, flatten, iter_animated
 from ren3d.mesh import Mesh
+from ren3d.bvh import build_BVH, FlatBVH
 from ren3d.camera import Camera
 from ren3d.materials import *
 from ren3d.textures import *
@@ -25,10 +27,90 @@ class Scene:
         self.shadows = False
         self.reflections = 0
         self.textures = False
-
+        self.bvh = "sah"        # BVH builder: "sah", "median" or None
+        self.pretransform_meshes = False
+        self.frames = 1         # number of frames, for animated scenes
+        self._surface = None
+        self._prims = None
+        # the last surface found blocking shadow rays toward each light
+        # (see render_ray); only valid for the current surface
+        self.occluders = {}
 
     def add(self, object):
         self.objects.add(object)
+        self.invalidate()
+
+    @property
+    def surface(self):
+        """the surface that rays are intersected against, compiled on
+        first use from the objects in the scene: Groups and chains of
+        Transformables are flattened (see models.flatten) so that each
+        primitive carries a single world transform, and transformed
+        meshes are moved into world space if pretransform_meshes is set.
+        When bvh names a builder, the primitives are put in a (flattened)
+        BVH; otherwise they are tested in turn.
+        """
+        if self._surface is None:
+            self._surface = self._build_surface()
+        return self._surface
+
+    def _build_surface(self):
+        surfaces = list(flatten(self.objects,
+                                meshes=self.pretransform_meshes))
+        self._prims = surfaces
+        if not (self.bvh and surfaces):
+            group = Group()
+            group.objects = surfaces
+            return group
+        method = "sah" if self.bvh is True else self.bvh
+        return FlatBVH(build_BVH(surfaces, method))
+
+    def invalidate(self):
+        """discard the acceleration structure (call after changing
+        objects that are already in the scene)"""
+        self._surface = None
+        self.occluders.clear()
+
+    def update_transforms(self):
+        """bring the compiled surface up to date after Transformables in
+        the scene have changed. If only transforms have changed, the
+        primitives are moved in place and the BVH is refitted, keeping
+        its tree; otherwise (or with pretransform_meshes) the surface is
+        rebuilt on next use."""
+        if self._surface is None:
+            return
+        if self.pretransform_meshes:
+            self.invalidate()
+            return
+        placed = list(flatten(self.objects))
+        if len(placed) != len(self._prims):
+            self.invalidate()
+            return
+        moved = False
+        for new, old in zip(placed, self._prims):
+            if type(new) != type(old):
+                self.invalidate()
+                return
+            if type(new) != Transformable:
+                if new is not old:
+                    self.invalidate()
+                    return
+            elif new.surface is not old.surface:
+                self.invalidate()
+                return
+            elif new.trans.m != old.trans.m:
+                old._set_trans(new.trans)
+                moved = True
+        if moved:
+            self.occluders.clear()
+            if type(self._surface) == FlatBVH:
+                self._surface.refit()
+
+    def set_frame(self, frame):
+        """pose every Animated object in the scene for frame"""
+        for obj in iter_animated(self.objects):
+            obj.set_frame(frame)
+        self.update_transforms()
 
     @property
     def background(self):
@@ -54,6 +136,44 @@ class Scene:
     def add_light(self, pos, color):
         self.lights.append((Point(pos), RGB(color)))
 
+
+# ----------------------------------------------------------------------
+# Animation
+#   An animated scene sets scene.frames and places its moving objects with
+#   Animated (see models.py), whose pose functions may use Keyframes.
+
+
+class Keyframes:
+    """A value that changes over the frames of an animation, given at
+    some key frames and interpolated linearly in between (and held
+    before the first and after the last). Values are numbers or
+    sequences of numbers.
+
+    >>> angle = Keyframes({0: 0, 4: 90, 6: 0})
+    >>> [angle(f) for f in (-1, 0, 2, 4, 5, 6, 9)]
+    [0, 0, 45.0, 90, 45.0, 0, 0]
+    >>> Keyframes({0: (0, 0), 10: (1, 2)})(5)
+    (0.5, 1.0)
+    """
+
+    def __init__(self, keys):
+        self.keys = sorted(keys.items())
+
+    def __call__(self, frame):
+        keys = self.keys
+        if frame <= keys[0][0]:
+            return keys[0][1]
+        for (f0, v0), (f1, v1) in zip(keys, keys[1:]):
+            if frame <= f1:
+                if frame == f1:
+                    return v1
+                s = (frame-f0) / (f1-f0)
+                if isinstance(v0, (int, float)):
+                    return v0 + s*(v1-v0)
+                return tuple(a + s*(b-a) for a, b in zip(v0, v1))
+        return keys[-1][1]
+
+
 # ----------------------------------------------------------------------
 # global scene
 #   for files that define a scene use: from scenedef import *
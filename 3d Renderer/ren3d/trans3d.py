@@ -2,7 +2,8 @@
 """matrices for performing 3D transformations in homogeneous coordinates"""
 
 from math import radians, sin, cos, tan
-from ren3d.math3d import Point, Vector
+from ren3d.math3d import Point, Vector, _point, _vector
+from ren3d.ray3d import _ray
 import ren3d.matrix as mat
 
 
@@ -93,6 +94,158 @@ def to_uvn(u, v, n, eye):
             [0, 0, 0, 1]]
 
 
+def _mul(a, b):
+    # product of two affine matrices given as 12-tuples of rows
+    a0, a1, a2, a3, a4, a5, a6, a7, a8, a9, a10, a11 = a
+    b0, b1, b2, b3, b4, b5, b6, b7, b8, b9, b10, b11 = b
+    return (a0*b0 + a1*b4 + a2*b8, a0*b1 + a1*b5 + a2*b9,
+            a0*b2 + a1*b6 + a2*b10, a0*b3 + a1*b7 + a2*b11 + a3,
+            a4*b0 + a5*b4 + a6*b8, a4*b1 + a5*b5 + a6*b9,
+            a4*b2 + a5*b6 + a6*b10, a4*b3 + a5*b7 + a6*b11 + a7,
+            a8*b0 + a9*b4 + a10*b8, a8*b1 + a9*b5 + a10*b9,
+            a8*b2 + a9*b6 + a10*b10, a8*b3 + a9*b7 + a10*b11 + a11)
+
+
+class Affine:
+    """An affine transformation, stored as the top three rows of a 4x4
+    homogeneous matrix (the bottom row is always 0 0 0 1).
+
+    Points and vectors are transformed with the matrix products written
+    out, and the inverse and normal transforms are cached once known.
+    """
+
+    __slots__ = ("m", "_inverse", "_normal")
+
+    def __init__(self, matrix=None, inverse=None):
+        """ Affine transform from a 4x4 matrix (identity if None). inverse,
+        if given, is the known inverse matrix or Affine.
+
+        >>> t = Affine(translate(1,2,3), translate(-1,-2,-3))
+        >>> t.apply_point(Point([1,1,1]))
+        Point([2.0, 3.0, 4.0])
+        >>> t.inverse().apply_point(Point([1,1,1]))
+        Point([0.0, -1.0, -2.0])
+        """
+        if matrix is None:
+            matrix = mat.unit(4)
+        self.m = tuple(float(x) for row in matrix[:3] for x in row)
+        if inverse is not None:
+            if not isinstance(inverse, Affine):
+                inverse = Affine(inverse)
+            if inverse._inverse is None:
+                inverse._inverse = self
+        self._inverse = inverse
+        self._normal = None
+
+    @classmethod
+    def _from_rows(cls, m, inverse=None):
+        # fast construction from a 12-tuple of floats
+        t = object.__new__(cls)
+        t.m = m
+        t._inverse = inverse
+        t._normal = None
+        return t
+
+    def __repr__(self):
+        """
+        >>> Affine(scale(2,3,4))
+        Affine([[2.0, 0.0, 0.0, 0.0], [0.0, 3.0, 0.0, 0.0], [0.0, 0.0, 4.0, 0.0], [0.0, 0.0, 0.0, 1.0]])
+        """
+        return "Affine({!r})".format(self.matrix())
+
+    def matrix(self):
+        """ this transform as a 4x4 list of lists """
+        m = self.m
+        return [list(m[0:4]), list(m[4:8]), list(m[8:12]),
+                [0.0, 0.0, 0.0, 1.0]]
+
+    def is_identity(self):
+        """
+        >>> Affine().is_identity()
+        True
+        >>> Affine(rotate_x(30)).is_identity()
+        False
+        """
+        return self.m == (1., 0., 0., 0., 0., 1., 0., 0., 0., 0., 1., 0.)
+
+    def compose(self, other):
+        """ returns the transform that applies other, then self (the
+        matrix product self * other). The inverse is carried along if
+        both inverses are known.
+
+        >>> t = Affine(translate(1,0,0)).compose(Affine(scale(2,2,2)))
+        >>> t.apply_point(Point([1,1,1]))
+        Point([3.0, 2.0, 2.0])
+        """
+        t = Affine._from_rows(_mul(self.m, other.m))
+        if self._inverse is not None and other._inverse is not None:
+            t._inverse = Affine._from_rows(
+                _mul(other._inverse.m, self._inverse.m), t)
+        return t
+
+    def inverse(self):
+        """ the inverse transform, computed on first use if not known
+
+        >>> t = Affine(rotate_y(90)).compose(Affine(scale(2,4,8)))
+        >>> p = t.inverse().apply_point(t.apply_point(Point([1,2,3])))
+        >>> [round(x, 12) for x in p]
+        [1.0, 2.0, 3.0]
+        """
+        if self._inverse is None:
+            a0, a1, a2, a3, a4, a5, a6, a7, a8, a9, a10, a11 = self.m
+            c0 = a5*a10 - a6*a9
+            c1 = a6*a8 - a4*a10
+            c2 = a4*a9 - a5*a8
+            det = a0*c0 + a1*c1 + a2*c2
+            if det == 0:
+                raise ValueError("transform is not invertible")
+            s = 1/det
+            i0, i1, i2 = s*c0, s*(a2*a9 - a1*a10), s*(a1*a6 - a2*a5)
+            i4, i5, i6 = s*c1, s*(a0*a10 - a2*a8), s*(a2*a4 - a0*a6)
+            i8, i9, i10 = s*c2, s*(a1*a8 - a0*a9), s*(a0*a5 - a1*a4)
+            m = (i0, i1, i2, -(i0*a3 + i1*a7 + i2*a11),
+                 i4, i5, i6, -(i4*a3 + i5*a7 + i6*a11),
+                 i8, i9, i10, -(i8*a3 + i9*a7 + i10*a11))
+            self._inverse = Affine._from_rows(m, self)
+        return self._inverse
+
+    def normal(self):
+        """ the transform for surface normals: the transpose of the
+        inverse, without translation
+
+        >>> Affine(scale(2,1,1), scale(.5,1,1)).normal()
+        Affine([[0.5, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0]])
+        """
+        if self._normal is None:
+            i = self.inverse().m
+            self._normal = Affine._from_rows((i[0], i[4], i[8], 0.0,
+                                              i[1], i[5], i[9], 0.0,
+                                              i[2], i[6], i[10], 0.0))
+        return self._normal
+
+    def apply_point(self, p):
+        m = self.m
+        x, y, z = p.x, p.y, p.z
+        return _point(m[0]*x + m[1]*y + m[2]*z + m[3],
+                      m[4]*x + m[5]*y + m[6]*z + m[7],
+                      m[8]*x + m[9]*y + m[10]*z + m[11])
+
+    def apply_vector(self, v):
+        """ transform a direction (translation does not apply)
+
+        >>> Affine(translate(1,2,3)).apply_vector(Vector([1,0,0]))
+        Vector([1.0, 0.0, 0.0])
+        """
+        m = self.m
+        x, y, z = v.x, v.y, v.z
+        return _vector(m[0]*x + m[1]*y + m[2]*z,
+                       m[4]*x + m[5]*y + m[6]*z,
+                       m[8]*x + m[9]*y + m[10]*z)
+
+    def apply_ray(self, ray):
+        return _ray(self.apply_point(ray.start), self.apply_vector(ray.dir))
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
@@ -0,0 +1,35 @@
+# run_aa.py -- raytrace a scene with adaptive antialiasing
+#    usage: python run_aa.py scene0 320 240 [threshold] [grid] [budget]
+# Pixels that differ from a neighbour by more than threshold (default .1)
+# are supersampled on up to a grid x grid pattern (default 4), within a
+# total of budget samples (default: no limit).
+
+import sys
+import time
+
+from ren3d.scenedef import load_scene
+from ren3d.render_ray import raytrace_adaptive
+from ren3d.image import Image
+
+
+def main():
+    scene, scenename = load_scene(sys.argv[1])
+    w, h = int(sys.argv[2]), int(sys.argv[3])
+    threshold = float(sys.argv[4]) if len(sys.argv) > 4 else .1
+    grid = int(sys.argv[5]) if len(sys.argv) > 5 else 4
+    budget = int(sys.argv[6]) if len(sys.argv) > 6 else None
+    img = Image((w, h))
+    t1 = time.time()
+    stats = raytrace_adaptive(scene, img, threshold, grid, budget)
+    t2 = time.time()
+    img.save("images/{}-aa-{:d}-{:d}.ppm".format(scenename, w, h))
+    img.show()
+    print(t2-t1, "seconds")
+    print("{} samples for {} pixels ({:.2f} per pixel), {} pixels refined"
+          .format(stats.samples, stats.pixels, stats.samples/stats.pixels,
+                  stats.refined))
+    input("Press <Enter> to quit")
+    img.unshow()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# run_anim.py -- render all the frames of an animated scene
+#    usage: python run_anim.py sceneFinalAnim 320 240 [output] [nworkers]
+# The frames are written as they are finished: to an animated GIF if
+# output ends in .gif (default images/<scene>-<w>-<h>.gif), otherwise as
+# numbered PPM files <output>-000.ppm, <output>-001.ppm, ...
+# With nworkers (0 means one per core), the tiles of all the frames are
+# traced by a pool of processes; without, the frames are traced one
+# after another, retracing only what changes between them.
+
+import sys
+import time
+
+from ren3d.gif import GIFWriter
+from ren3d.render_anim import raytrace_animation, raytrace_animation_parallel
+from ren3d.scenedef import load_scene
+
+
+def frames_of(scenename, size, nworkers):
+    # yields (frame, image) as the frames are finished
+    if nworkers is None:
+        scene, scenename = load_scene(scenename)
+        for frame, img, stats in raytrace_animation(scene, size):
+            yield frame, img
+    else:
+        yield from raytrace_animation_parallel(scenename, size, None,
+                                               nworkers or None)
+
+
+def main():
+    scenename = sys.argv[1]
+    if scenename.endswith(".py"):
+        scenename = scenename[:-3]
+    w, h = int(sys.argv[2]), int(sys.argv[3])
+    if len(sys.argv) > 4:
+        output = sys.argv[4]
+    else:
+        output = "images/{}-{:d}-{:d}.gif".format(scenename, w, h)
+    nworkers = int(sys.argv[5]) if len(sys.argv) > 5 else None
+
+    gif = GIFWriter(output, (w, h)) if output.endswith(".gif") else None
+    t1 = time.time()
+    for frame, img in frames_of(scenename, (w, h), nworkers):
+        if gif:
+            gif.add(img)
+        else:
+            img.save("{}-{:03d}.ppm".format(output, frame))
+        print("frame", frame, "done", round(time.time()-t1, 1), "seconds")
+        sys.stdout.flush()
+    if gif:
+        gif.close()
+    print(round(time.time()-t1, 1), "seconds")
+
+
+if __name__ == "__main__":
+    main()
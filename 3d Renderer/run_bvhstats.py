@@ -0,0 +1,38 @@
+# run_bvhstats.py -- compare the BVH builders on a scene
+#    usage: python run_bvhstats.py spheres10k [width height]
+# With a width and height, also times a raytrace using each builder.
+
+import sys
+import time
+
+from ren3d.scenedef import load_scene
+from ren3d.bvh import BUILDERS, bvh_stats
+from ren3d.render_ray import raytrace
+from ren3d.image import Image
+
+
+def main():
+    scene, scenename = load_scene(sys.argv[1])
+    size = None
+    if len(sys.argv) > 3:
+        size = int(sys.argv[2]), int(sys.argv[3])
+    for method in BUILDERS:
+        scene.bvh = method
+        scene.invalidate()
+        t1 = time.time()
+        stats = bvh_stats(scene.surface)
+        t2 = time.time()
+        print("{}: built in {:0.2f} s".format(method, t2-t1))
+        print("  nodes: {} leaves: {} surfaces: {}".format(
+            stats.nodes, stats.leaves, stats.surfaces))
+        print("  depth: max {} avg {:0.1f}   leaf size: max {} avg {:0.2f}".format(
+            stats.max_depth, stats.avg_depth, stats.max_leaf, stats.avg_leaf))
+        print("  expected cost per ray: {:0.2f}".format(stats.cost))
+        if size:
+            t1 = time.time()
+            raytrace(scene, Image(size))
+            print("  raytrace: {:0.2f} s".format(time.time()-t1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+# run_packet.py -- raytrace a scene with the NumPy packet tracer
+#    usage: python run_packet.py scene0 320 240
+# Scenes the packet tracer does not support (or any scene, without
+# NumPy) are traced by the ordinary ray tracer.
+
+import sys
+import time
+
+from ren3d.scenedef import load_scene
+from ren3d.render_packet import raytrace_packets, packet_support
+from ren3d.image import Image
+
+
+def main():
+    scene, scenename = load_scene(sys.argv[1])
+    w, h = int(sys.argv[2]), int(sys.argv[3])
+    reason = packet_support(scene)
+    if reason:
+        print("tracing without packets:", reason)
+    img = Image((w, h))
+    t1 = time.time()
+    raytrace_packets(scene, img)
+    t2 = time.time()
+    img.save("images/{}-rt-{:d}-{:d}.ppm".format(scenename, w, h))
+    img.show()
+    print(t2-t1, "seconds")
+    input("Press <Enter> to quit")
+    img.unshow()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+# run_prog.py -- raytrace a scene progressively, coarse to fine
+#    usage: python run_prog.py scene0 320 240 [seconds]
+# A blocky preview of the whole image appears first and is refined in
+# passes; with a time limit, rendering stops when it runs out.
+
+import sys
+import time
+
+from ren3d.image import Image
+from ren3d.render_ray import raytrace_progressive
+from ren3d.scenedef import load_scene
+
+
+def main():
+    scene, scenename = load_scene(sys.argv[1])
+    w, h = int(sys.argv[2]), int(sys.argv[3])
+    budget = float(sys.argv[4]) if len(sys.argv) > 4 else None
+    img = Image((w, h))
+    t1 = time.time()
+    step = raytrace_progressive(scene, img, budget=budget, updatefn=img.show)
+    t2 = time.time()
+    img.save("images/{}-rt-{:d}-{:d}.ppm".format(scenename, w, h))
+    img.show()
+    print(t2-t1, "seconds")
+    if step > 1:
+        print("stopped with {0}x{0} blocks".format(step))
+    input("Press <Enter> to quit")
+    img.unshow()
+
+if __name__ == "__main__":
+    main()
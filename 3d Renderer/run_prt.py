@@ -1,26 +1,16 @@
 # run_prt.py
 # by: John Zelle
+#    usage: python run_prt.py scene0 320 240 [nworkers] [order]
+# Traces the scene with a pool of worker processes that are handed
+# tiles of the image as they become free (see render_ray.order_tiles
+# for the orders).
 
 import sys
-import os
 import time
-import pickle
 
-from ren3d.image import Image
-
-command = "python run_chunk.py {scene} {width} {height} {nchunks} {offset} &"
-FNAME = "chunks/chunk{:02d}"
-
-def assemble_chunks(chunks, size):
-    nchunks = len(chunks)
-    img = Image(size)
-    for chunk_num, chunk in enumerate(chunks):
-        y = chunk_num
-        for line in chunk:
-            for x in range(size[0]):
-                img[x, y] = line[x]
-            y += nchunks
-    return img
+from ren3d.image import SharedImage
+from ren3d.render_ray import raytrace_parallel, make_tiles
+from ren3d.render_ray import shadow_cache_report
 
 
 def main():
@@ -28,44 +18,37 @@ def main():
     width = int(sys.argv[2])
     height = int(sys.argv[3])
     try:
-        nchunks = int(sys.argv[4])
+        nworkers = int(sys.argv[4])
     except IndexError:
-        nchunks = 4
+        nworkers = 4
+    try:
+        order = sys.argv[5]
+    except IndexError:
+        order = "cost"
 
-    os.system("rm -rf chunks/*")
-    args = dict(scene=scene, width=width, height=height, nchunks=nchunks)
-    t1 = time.time()
-    # launch process to compute chunks
-    for offset in range(nchunks):
-        args["offset"] = offset
-        os.system(command.format(**args))
-    print("Launched")
+    img = SharedImage((width, height))
+    ntiles = len(make_tiles(img.size))
+    done = 0
 
-    # wait for all the chunks
-    for i in range(nchunks):
-        fname = FNAME.format(i)
-        while not os.path.isfile(fname+".status"):
-            time.sleep(.5)
-        print(i, end=" ")
+    def update():
+        nonlocal done
+        done += 1
+        print(done, "/", ntiles, end="\r")
         sys.stdout.flush()
-    time.sleep(.1)
 
-    # harvest and assemble_chunks
-    chunks = []
-    for i in range(nchunks):
-        fname = FNAME.format(i)
-        with open(fname, "rb") as infile:
-            chunks.append(pickle.load(infile))
-    print()
-
-    img = assemble_chunks(chunks, (width, height))
+    t1 = time.time()
+    raytrace_parallel(scene, img, nworkers, update, order=order)
     t2 = time.time()
+    print()
 
     img.show()
     img.save("images/{}-rt-{:d}-{:d}.ppm".format(scene, width, height))
     print(round(t2-t1,1), "seconds")
+    if shadow_cache_report():
+        print(shadow_cache_report())
     input("Press <Enter> to quit")
     img.unshow()
+    img.close()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,15 @@
 # run_rt.py -- raytrace a scene with a simple progress indicator
-#    usage: pypy run_rt.py scene0 320 240
+#    usage: pypy run_rt.py scene0 320 240 [nworkers]
+# With nworkers, the image is traced by that many processes (0 means
+# one per core).
 
 import sys
 import time
 
 from ren3d.scenedef import load_scene
-from ren3d.render_ray import raytrace
-from ren3d.image import Image
+from ren3d.render_ray import raytrace, raytrace_parallel, make_tiles
+from ren3d.render_ray import shadow_cache_report
+from ren3d.image import Image, SharedImage
 
 
 class Progress:
@@ -24,15 +27,26 @@ class Progress:
 def main():
     scene, scenename = load_scene(sys.argv[1])
     w, h = int(sys.argv[2]), int(sys.argv[3])
-    img = Image((w, h))
+    parallel = len(sys.argv) > 4
+    img = SharedImage((w, h)) if parallel else Image((w, h))
     t1 = time.time()
-    raytrace(scene, img, Progress(h).show)
+    if parallel:
+        nworkers = int(sys.argv[4]) or None
+        ntiles = len(make_tiles(img.size))
+        raytrace_parallel(scenename, img, nworkers, Progress(ntiles).show,
+                          scene=scene)
+    else:
+        raytrace(scene, img, Progress(h).show)
     t2 = time.time()
     img.save("images/{}-rt-{:d}-{:d}.ppm".format(scenename, w, h))
     img.show()
     print(t2-t1, "seconds")
+    if shadow_cache_report():
+        print(shadow_cache_report())
     input("Press <Enter> to quit")
     img.unshow()
+    if parallel:
+        img.close()
 
 if __name__ == "__main__":
     main()
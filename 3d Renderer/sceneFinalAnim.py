@@ -0,0 +1,227 @@
+# sceneFinalAnim.py
+#    The final animation (sceneFinal, sceneFinal2 ... sceneFinal12) as one
+#    scene of 12 frames: the cradle swings, the globe turns and the
+#    loading bar on the screen fills.
+
+from ren3d.scenedef import *
+from math import sin, cos, pi
+
+scene.frames = 12
+
+# cradle swing, in steps of 15 degrees: the right ball swings out and
+# back over frames 0-6, then the left one over frames 6-12
+right_swing = Keyframes({0: 0, 3: 3, 6: 0})
+left_swing = Keyframes({6: 0, 9: 3, 12: 0})
+bar_width = Keyframes({0: .1, 1: .5, 2: 1, 3: 1.5, 4: 2.5, 5: 2.5, 6: 4,
+                       7: 5, 8: 5, 9: 6, 10: 7, 11: 7.5})
+
+
+def swing_offset(steps):
+    # offset of a cradle ball swung out by steps
+    steps = round(steps)
+    return (sum(cos(k*pi/12) for k in range(1, steps+1)),
+            sum(sin(k*pi/12) for k in range(1, steps+1)))
+
+
+def right_ball(t, frame):
+    dx, dy = swing_offset(right_swing(frame))
+    t.translate(4+dx, dy, 0)
+
+
+def left_ball(t, frame):
+    dx, dy = swing_offset(left_swing(frame))
+    t.translate(-4-dx, dy, 0)
+
+
+def right_string(t, frame):
+    a = right_swing(frame) * 15
+    t.scale(.1, 5, .1).rotate_z(a)
+    t.translate(4+2*sin(a*pi/180), 2.5+(2.5-2.5*cos(a*pi/180)), 0)
+
+
+def left_string(t, frame):
+    a = left_swing(frame) * 15
+    t.scale(.1, 5, .1).rotate_z(-a)
+    t.translate(-4-2*sin(a*pi/180), 2.5+(2.5-2.5*cos(a*pi/180)), 0)
+
+
+def loading_bar(t, frame):
+    # the bar grows to the right from x = -3.75
+    width = bar_width(frame)
+    t.scale(width, 1, 1).translate(-3.75 + width/2, 1, 8.1)
+
+
+#g = Transformable(Box(color=Material((.3, .2, .4)))).scale(150, 2, 150)
+#scene.add(g)
+scene.textures = True
+
+
+#desk
+tp = Transformable(Mesh("desk.off", color = make_material((75/255, 43/255, 32/255)),
+                        smooth=False, recenter=True))
+tp.scale(69, 69, 69).translate(0, 0, 0)
+scene.add(tp)
+
+
+#mug
+tp = Transformable(Mesh("m504.off", SILVER,
+                        smooth=True, recenter=True))
+tp.scale(6.5, 6.5, 6.5).translate(-16, 3, 10)
+scene.add(tp)
+
+
+#computer
+group = Group()
+t = Transformable(Mesh("m548.off", SILVER,
+                        smooth=False, recenter=True))
+t.scale(20, 20, 20)
+group.add(t)
+
+group.add(Transformable(Box(pos=(0, 4, 8), size=(11, 7, .5),
+              color=BLACK_PLASTIC,
+              texture=Boxtexture("textures/loading.ppm"))))
+
+group.add(Transformable(Box(pos=(0, 2, 8), size=(11, 11, .5),
+              color=BLACK_PLASTIC)))
+
+group.add(Transformable(Box(pos=(0, 2.25, 8.1), size=(8, .25, .5),
+              color=GREY_PLASTIC)))
+group.add(Transformable(Box(pos=(0, -.25, 8.1), size=(8, .25, .5),
+              color=GREY_PLASTIC)))
+group.add(Transformable(Box(pos=(4, 1, 8.1), size=(.25, 2.5, .5),
+              color=GREY_PLASTIC)))
+group.add(Transformable(Box(pos=(-4, 1, 8.1), size=(.25, 2.5, .5),
+              color=GREY_PLASTIC)))
+
+group.add(Animated(Box(size=(1, 1.75, .5), color=GREY_PLASTIC),
+                   loading_bar))
+
+for obj in group.objects:
+    obj.scale(.85, .85, .85).translate(-2, 8, 6.5)
+
+
+scene.add(group)
+
+
+#cradle
+silver = Material(diffuse=(.2, .2, .2), specular=(.6, .6, .6),
+                  shininess=100, reflect=(.4, .4, .4))
+group = Group()
+
+group.add(Transformable(Sphere(pos=(0, 0, 0), radius=1, color=silver)))
+group.add(Transformable(Sphere(pos=(2, 0, 0), radius=1, color=silver)))
+group.add(Transformable(Sphere(pos=(-2, 0, 0), radius=1, color=silver)))
+group.add(Animated(Sphere(radius=1, color=silver), left_ball))
+group.add(Animated(Sphere(radius=1, color=silver), right_ball))
+
+g = Transformable(Box(color=Material((.82, .41, .12))))
+g.scale(.1, 5, .1).translate(0, 2.5, 0)
+group.add(g)
+g = Transformable(Box(color=Material((.82, .41, .12))))
+g.scale(.1, 5, .1).translate(-2, 2.5, 0)
+group.add(g)
+g = Transformable(Box(color=Material((.82, .41, .12))))
+g.scale(.1, 5, .1).translate(2, 2.5, 0)
+group.add(g)
+group.add(Animated(Box(color=Material((.82, .41, .12))), right_string))
+group.add(Animated(Box(color=Material((.82, .41, .12))), left_string))
+
+g = Transformable(Box(color=GOLD))
+g.scale(12, .25, .25).translate(0, 5, 0)
+group.add(g)
+g = Transformable(Box(color=GOLD))
+g.scale(.25, 10, .25).rotate_x(-36.87).translate(5.75, 1, 3)
+group.add(g)
+g = Transformable(Box(color=GOLD))
+g.scale(.25, 10, .25).rotate_x(36.87).translate(5.75, 1, -3)
+group.add(g)
+g = Transformable(Box(color=GOLD))
+g.scale(.25, 10, .25).rotate_x(-36.87).translate(-5.75, 1, 3)
+group.add(g)
+g = Transformable(Box(color=GOLD))
+g.scale(.25, 10, .25).rotate_x(36.87).translate(-5.75, 1, -3)
+group.add(g)
+for obj in group.objects:
+    obj.rotate_y(10).translate(15, 3, 5)
+scene.add(group)
+
+
+#floor
+r = Box(pos=(0, 0, 0), size=(50, .1, 50), color = (0, 0, .2), texture=Boxtexture("textures/carpet.ppm"))
+rug = Transformable(r)
+rug.rotate_y(45).translate(0, -30, 0)
+scene.add(rug)
+
+bmat = Material((.4, .4, .4), reflect=(.4, .4, .4))
+floor = Transformable((Box(pos=(0, -30.5, 0), size=(200, 1, 120),
+              color=bmat, texture=Boxtexture("textures/wood.ppm"))))
+floor.rotate_y(25).translate(0, 0, -15)
+scene.add(floor)
+
+#globe
+
+globegroup = Group()
+s = Sphere(pos=(0, 0, 0), radius=3,
+        color=BRASS,
+        texture=Spheretexture("textures/globe.ppm"))
+globe = Animated(s, lambda t, frame: t.rotate_y(30*frame))
+globegroup.add(globe)
+
+thick = .2
+oh = Sphere((0, 0, 0), .5, color=GOLD)
+oh1 = Transformable(oh)
+oh1.scale(2.10, .5, 2.10).translate(0, -5, 0)#.translate(0, thick/2, 0)
+globegroup.add(oh1)
+
+post = Box(pos=(0, 0, 0), size=(1, 1, 1), color = GOLD)
+post1 = Transformable(post)
+post1.scale(.5, 1.75, .5).translate(0, -3.875, 0)
+globegroup.add(post1)
+
+for obj in globegroup.objects:
+    obj.scale(2, 2, 2).translate(-8, 32, -5)
+
+scene.add(globegroup)
+
+
+#modle Car
+silver = Material(diffuse=(.2, .2, .2), specular=(.6, .6, .6),
+                  shininess=100, reflect=(.4, .4, .4))
+
+tp = Transformable(Mesh("m1549.off", SILVER,
+                        smooth=False, recenter=True))
+tp.scale(13, 13 ,13).rotate_y(135).translate(12, 23, -4)
+scene.add(tp)
+
+
+
+#Books
+tp = Transformable(Mesh("m1791.off", color=make_material((.25, 0, 0)),
+                        smooth=False, recenter=True))
+tp.scale(8, 8, 8).rotate_z(90).translate(15, 16, -3)
+scene.add(tp)
+tp = Transformable(Mesh("m1791.off", color=make_material((0, .25, 0)),
+                        smooth=False, recenter=True))
+tp.scale(8, 8, 8).rotate_z(90).translate(15, 14.5, -2)
+scene.add(tp)
+tp = Transformable(Mesh("m1791.off", color=make_material((0, 0, .25)),
+                        smooth=False, recenter=True))
+tp.scale(6, 6, 6).rotate_z(-20).translate(20, 8, -2)
+scene.add(tp)
+tp = Transformable(Mesh("m1791.off", color=make_material((.25, .25, .0)),
+                        smooth=False, recenter=True))
+tp.scale(8, 8, 8).rotate_z(90).translate(10, 7, -2)
+scene.add(tp)
+tp = Transformable(Mesh("m1791.off", color=make_material((.25, 0, .25)),
+                        smooth=False, recenter=True))
+tp.scale(6, 6, 6).rotate_z(20).translate(3, 16, -3)
+scene.add(tp)
+
+
+camera.set_perspective(40, 4/3, 3)
+camera.set_view((60, 65, 125), (0, 0, 0), (0, 1, 0))
+
+scene.set_light((60, 100, 100), (1, 1, 1))
+scene.ambient = (.5, .5, .5)
+scene.background = (0, 0, 0)
+scene.shadows = True
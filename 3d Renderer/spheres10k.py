@@ -34,4 +34,4 @@ scene.reflections = 3
 scene.shadows = True
 scene.ambient = (.2, .2, .2)
 # scene.setBackground((.4,0,0))
-#scene.surface = scene.surface.getBVH()
+# scene.bvh = None   # to test every sphere for every ray